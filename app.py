@@ -1,15 +1,38 @@
 import os
 import io
 import base64
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify
+import cProfile
+import hashlib
+import json
+import math
+import multiprocessing
+import pstats
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+import click
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, send_file, jsonify, stream_with_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession, contains_eager, joinedload, load_only
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
-from PIL import Image
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-import math
+from packet import Cell, ImageCache, Layout, PageCache, PdfImage, build_page, iter_chunks, prepare_images, render_pages
+from blobstore import open_blob_store
+from cache import open_cache
+from metrics import QUERY_BUCKETS, Registry, Timed, timed_call
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -18,7 +41,67 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:/
 if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
     app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Connections per web worker: pool_size kept open, up to max_overflow more under load, waiting
+    # DB_POOL_TIMEOUT seconds for one after that. Checked before use and replaced after DB_POOL_RECYCLE
+    # seconds, so connections dropped by the server or a proxy never surface as request errors
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        # A runaway query fails instead of holding its connection (and a worker) indefinitely
+        statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
+app.config['PDF_BATCH_SIZE'] = int(os.environ.get('PDF_BATCH_SIZE', 100))  # signatures fetched per query while streaming a PDF
+app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR', os.path.join(app.instance_path, 'pdf_cache'))
+app.config['EXPORT_DIR'] = os.environ.get('EXPORT_DIR', os.path.join(app.instance_path, 'exports'))
+app.config['EXPORT_WORKERS'] = int(os.environ.get('EXPORT_WORKERS', 2))  # background PDF renders per web worker
+app.config['PDF_RENDER_PROCESSES'] = int(os.environ.get('PDF_RENDER_PROCESSES', os.cpu_count() or 1))  # 1 disables the process pool
+app.config['REPORT_PAGE_SIZE'] = int(os.environ.get('REPORT_PAGE_SIZE', 60))  # signature cards per report page
+app.config['BLOB_STORE_URL'] = os.environ.get('BLOB_STORE_URL', os.path.join(app.instance_path, 'blobs'))
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')  # for S3-compatible stores such as MinIO
+if 'BLOB_STORE_URL' not in os.environ and not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # The default lives on the web service's own disk, which hosts such as Render wipe on every deploy
+    raise RuntimeError('BLOB_STORE_URL must be set when using a database server: an s3:// bucket or a '
+                       'directory on a persistent disk (see DEPLOYMENT.md)')
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_MB', 64)) * 1024 * 1024  # in-process image cache per web worker
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL')  # optional shared cache: redis://... or a directory
+app.config['UPLOAD_PROCESSES'] = int(os.environ.get('UPLOAD_PROCESSES', 2))  # image processing workers per web worker
+app.config['UPLOAD_QUEUE_LIMIT'] = int(os.environ.get('UPLOAD_QUEUE_LIMIT', 16))  # uploads waiting or in progress before new ones get a 503
+app.config['UPLOAD_RETRY_AFTER'] = int(os.environ.get('UPLOAD_RETRY_AFTER', 5))  # seconds clients are told to wait when saturated
+app.config['UPLOAD_CHUNK_DIR'] = os.environ.get('UPLOAD_CHUNK_DIR', os.path.join(app.instance_path, 'uploads'))  # resumable uploads in progress; shared by workers
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_KB', 256)) * 1024  # bytes per request of a resumable upload
+app.config['UPLOAD_CHUNK_TTL'] = timedelta(hours=int(os.environ.get('UPLOAD_CHUNK_TTL_HOURS', 24)))  # abandoned resumable uploads are deleted after this
+app.config['UPLOAD_CLIENT_MAX_PX'] = int(os.environ.get('UPLOAD_CLIENT_MAX_PX', 2000))  # browsers shrink photos to at most this many pixels a side before uploading
+app.config['IMAGE_PRESET'] = os.environ.get('IMAGE_PRESET', 'balanced')  # PNG encoder effort: fast, balanced or small
+app.config['IMAGE_TRIM'] = os.environ.get('IMAGE_TRIM', '1') == '1'  # crop uploads to the ink plus a small margin
+app.config['IMAGE_QUANTIZE'] = os.environ.get('IMAGE_QUANTIZE', 'auto')  # auto, none, gray, bilevel or palette
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')  # shared by gunicorn workers so /metrics covers all of them
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # if set, /metrics needs it as a bearer token (or an admin session)
+app.config['REPORT_SHEET_FORMAT'] = os.environ.get('REPORT_SHEET_FORMAT', 'png').upper()  # report contact sheets: PNG or WEBP
+app.config['CHANGES_SETTLE'] = timedelta(seconds=int(os.environ.get('CHANGES_SETTLE_SECONDS', 10)))  # longest a write transaction may take to commit
+app.config['SESSION_STATUS_TTL'] = int(os.environ.get('SESSION_STATUS_TTL', 30))  # seconds a ranger's signature status may be served from their session
+app.config['EXPORT_JOB_TIMEOUT'] = timedelta(minutes=int(os.environ.get('EXPORT_JOB_TIMEOUT_MINUTES', 30)))
+
+# Packet layout: landscape Letter with 2.4" x 1.2" cells
+PDF_LAYOUT = Layout()
+
+# Request, database and processing-stage timings, served at /metrics
+metrics = Registry(app.config['METRICS_DIR'])
+metrics.histogram('http_request_duration_seconds', 'Time to serve a request, including streaming the body',
+                  ('route', 'method', 'status'))
+metrics.histogram('http_request_queries', 'SQL statements per request', ('route',), QUERY_BUCKETS)
+metrics.histogram('http_request_db_seconds', 'Time per request spent in SQL statements', ('route',))
+metrics.counter('db_queries_total', 'SQL statements executed')
+metrics.counter('db_query_seconds_total', 'Time spent in SQL statements')
+metrics.histogram('span_duration_seconds', 'Time spent in a stage of upload processing, PDF rendering or blob access',
+                  ('span',))
+metrics.counter('pdf_pages_total', 'PDF packet pages written, by whether they came from the page cache', ('source',))
 
 # Admin password for viewing signatures
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
@@ -38,48 +121,1129 @@ class Signature(db.Model):
     __tablename__ = 'signatures'
     id = db.Column(db.Integer, primary_key=True)
     ranger_id = db.Column(db.Integer, db.ForeignKey('rangers.id'), nullable=False, unique=True)
-    image_data = db.Column(db.LargeBinary, nullable=False)
+    # Legacy; images now live in the blob store. Deferred so loading a Signature never pulls the bytes
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    image_hash = db.Column(db.String(64), nullable=True, index=True)  # blob store key (SHA-256 of the image)
+    source_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the file as uploaded or imported, before processing
+    image_size = db.Column(db.Integer, nullable=True)
+    image_width = db.Column(db.Integer, nullable=True)
+    image_height = db.Column(db.Integer, nullable=True)
     image_format = db.Column(db.String(10), default='PNG')
-    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    thumb_hash = db.Column(db.String(64), nullable=True)  # blob store key of the report thumbnail
+    processing = db.Column(db.Boolean, default=False)  # raw upload stored, processed image not filled in yet
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Approval workflow
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
     approved_at = db.Column(db.DateTime, nullable=True)
     rejected_at = db.Column(db.DateTime, nullable=True)
     rejection_reason = db.Column(db.Text, nullable=True)
+    # Bumped by every change to the row, including bulk UPDATEs; what status pollers compare against
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Image quality, measured when the image is processed (see quality.py); NULL until then
+    ink_coverage = db.Column(db.Float, nullable=True)
+    ink_width = db.Column(db.Integer, nullable=True)
+    ink_height = db.Column(db.Integer, nullable=True)
+    contrast = db.Column(db.Float, nullable=True)
+    background_level = db.Column(db.Float, nullable=True)
+    background_noise = db.Column(db.Float, nullable=True)
+    ink_hash = db.Column(db.String(16), nullable=True, index=True)  # difference hash; shared by duplicates
+    quality_score = db.Column(db.Float, nullable=True)  # 0-1, the worst of the checks
+    quality_issue = db.Column(db.String(20), nullable=True)  # first failed check; NULL when clean or not scored
+    
+    __table_args__ = (
+        # Serves status filters (the report's pending queue) in upload order, and keyset pagination over them
+        db.Index('ix_signatures_status_uploaded_at', 'status', 'uploaded_at', 'id'),
+        # Serves the report's "changed since" feed
+        db.Index('ix_signatures_updated_at', 'updated_at', 'id'),
+        # Serve quality filters within a status, and the report's worst-first order
+        db.Index('ix_signatures_status_quality_issue', 'status', 'quality_issue', 'uploaded_at', 'id'),
+        db.Index('ix_signatures_status_quality_score', 'status', 'quality_score', 'id'),
+    )
+
+class ExportJob(db.Model):
+    __tablename__ = 'export_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed, expired
+    pages_done = db.Column(db.Integer, default=0)
+    pages_total = db.Column(db.Integer, default=0)
+    signature_count = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+def upgrade_schema():
+    """Bring an existing database in line with the models.
+    
+    db.create_all() only creates missing tables, so columns, indexes and
+    relaxed NOT NULL constraints added since a table was created are applied here.
+    """
+    engine = db.engine
+    inspector = db.inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name']: c for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            
+            relaxed = [c.name for c in table.columns
+                       if c.nullable and c.name in existing and not existing[c.name]['nullable']]
+            if not relaxed:
+                continue
+            if engine.dialect.name == 'sqlite':
+                # SQLite cannot drop NOT NULL in place; rebuild the table with the new definition
+                columns = ', '.join(c.name for c in table.columns)
+                for index in inspector.get_indexes(table.name):
+                    conn.execute(db.text(f'DROP INDEX {index["name"]}'))
+                conn.execute(db.text('PRAGMA legacy_alter_table = ON'))
+                conn.execute(db.text(f'ALTER TABLE {table.name} RENAME TO _{table.name}_old'))
+                table.create(conn)
+                conn.execute(db.text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM _{table.name}_old'))
+                conn.execute(db.text(f'DROP TABLE _{table.name}_old'))
+                conn.execute(db.text('PRAGMA legacy_alter_table = OFF'))
+            else:
+                for name in relaxed:
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL'))
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+# Signature columns the report and dashboard need; everything except image bytes
+REPORT_COLUMNS = (
+    Signature.id, Signature.ranger_id, Signature.status, Signature.uploaded_at,
+    Signature.approved_at, Signature.rejected_at, Signature.rejection_reason, Signature.updated_at,
+    Signature.image_width, Signature.image_height, Signature.quality_score, Signature.quality_issue,
+)
+
+SIGNATURE_STATUSES = ('pending', 'approved', 'rejected')
+QUALITY_COLUMNS = ('ink_coverage', 'ink_width', 'ink_height', 'contrast', 'background_level', 'background_noise',
+                   'ink_hash', 'quality_score', 'quality_issue')
+
+def status_counts():
+    """Number of signatures in each status, in one GROUP BY query"""
+    counts = dict.fromkeys(SIGNATURE_STATUSES, 0)
+    counts.update(db.session.query(Signature.status, db.func.count(Signature.id)).group_by(Signature.status).all())
+    return counts
 
-# Create tables
-with app.app_context():
+def encode_cursor(signature, sort=None):
+    if sort == 'quality':
+        return f'{signature.quality_score!r}_{signature.id}'
+    return f'{signature.uploaded_at.isoformat()}_{signature.id}'
+
+def decode_cursor(cursor, sort=None):
+    value, _, sig_id = cursor.rpartition('_')
+    return (float(value) if sort == 'quality' else datetime.fromisoformat(value)), int(sig_id)
+
+def quality_condition(quality):
+    """Filter for a report quality choice: 'clean', 'flagged' or one issue; None for anything else"""
+    from quality import QUALITY_ISSUES
+    if quality == 'clean':
+        return Signature.quality_issue.is_(None) & Signature.quality_score.isnot(None)
+    if quality == 'flagged':
+        return Signature.quality_issue.isnot(None)
+    if quality in QUALITY_ISSUES:
+        return Signature.quality_issue == quality
+    return None
+
+def quality_counts(status=None):
+    """Number of scored signatures per quality issue ('clean' for none), in one GROUP BY query"""
+    query = (db.session.query(Signature.quality_issue, db.func.count(Signature.id))
+             .filter(Signature.quality_score.isnot(None)))
+    if status:
+        query = query.filter(Signature.status == status)
+    counts = {issue or 'clean': count for issue, count in query.group_by(Signature.quality_issue)}
+    counts.setdefault('clean', 0)
+    counts['flagged'] = sum(count for issue, count in counts.items() if issue != 'clean')
+    return counts
+
+def encode_change_cursor(updated_at, sig_id):
+    return f'{updated_at.isoformat(timespec="microseconds")}_{sig_id}'
+
+def change_feed_start():
+    """Cursor for a page rendered now: CHANGES_SETTLE back, as changed_since never moves further ahead"""
+    return encode_change_cursor(datetime.utcnow() - app.config['CHANGES_SETTLE'], 0)
+
+def changed_since(cursor, limit=200):
+    """Rangers whose signature changed after cursor, oldest change first, and the cursor to poll from next.
+    
+    updated_at is set when a statement runs, not when its transaction commits,
+    so a slow transaction can commit a change older than one already returned.
+    The cursor therefore only moves past changes older than CHANGES_SETTLE;
+    newer ones are returned again by the next polls, until they settle, and the
+    report skips cards it already shows at that version.
+    """
+    rangers = (Ranger.query
+               .join(Ranger.signature)
+               .options(contains_eager(Ranger.signature).load_only(*REPORT_COLUMNS))
+               .filter(tuple_(Signature.updated_at, Signature.id) > decode_cursor(cursor))
+               .order_by(Signature.updated_at, Signature.id)
+               .limit(limit)
+               .all())
+    settled = datetime.utcnow() - app.config['CHANGES_SETTLE']
+    for ranger in rangers:
+        if ranger.signature.updated_at > settled:
+            break
+        cursor = encode_change_cursor(ranger.signature.updated_at, ranger.signature.id)
+    return rangers, cursor
+
+def report_page(status=None, after=None, per_page=None, quality=None, sort=None):
+    """One page of report rows, oldest upload first, and the cursor for the next page.
+    
+    Pages are keyset-based on (uploaded_at, id), so deep pages cost the same as
+    the first one and approvals between requests never shift rows around. With
+    sort='quality' they are ordered worst quality score first instead, keyed on
+    (quality_score, id), leaving out signatures not scored yet.
+    """
+    per_page = max(1, min(per_page or app.config['REPORT_PAGE_SIZE'], 500))
+    query = (Ranger.query
+             .join(Ranger.signature)
+             .options(contains_eager(Ranger.signature).load_only(*REPORT_COLUMNS)))
+    if status:
+        query = query.filter(Signature.status == status)
+    condition = quality_condition(quality)
+    if condition is not None:
+        query = query.filter(condition)
+    if sort == 'quality':
+        order = (Signature.quality_score, Signature.id)
+        query = query.filter(Signature.quality_score.isnot(None))
+    else:
+        order = (Signature.uploaded_at, Signature.id)
+    if after:
+        query = query.filter(tuple_(*order) > decode_cursor(after, sort))
+    
+    rangers = query.order_by(*order).limit(per_page + 1).all()
+    next_cursor = encode_cursor(rangers[per_page - 1].signature, sort) if len(rangers) > per_page else None
+    return rangers[:per_page], next_cursor
+
+def init_db():
+    """Create missing tables and apply upgrade_schema; run once per deploy, not by every worker"""
     db.create_all()
+    upgrade_schema()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database tables, or bring an existing database up to date with the models"""
+    init_db()
+    click.echo('Database schema is up to date.')
+
+_image_pipeline = None
+
+def image_pipeline():
+    """How uploads are decoded, resized and encoded; see imaging.py and benchmark_images.py"""
+    global _image_pipeline
+    if _image_pipeline is None:
+        # imaging (and with it Pillow) is imported on first use, not when a worker boots
+        from imaging import Pipeline
+        _image_pipeline = Pipeline(preset=app.config['IMAGE_PRESET'], quantize=app.config['IMAGE_QUANTIZE'],
+                                   trim=app.config['IMAGE_TRIM'])
+    return _image_pipeline
+
+_blob_store = None
+
+def blob_store():
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = Timed(open_blob_store(app.config['BLOB_STORE_URL'], app.config['S3_ENDPOINT_URL']),
+                            metrics, 'span_duration_seconds', 'blob_', ('get', 'put', 'open'))
+    return _blob_store
+
+def store_signature_image(image_data):
+    """Put image bytes (and a thumbnail) in the blob store and return the Signature columns describing them"""
+    from PIL import Image
+    from imaging import make_thumbnail
+    columns = {
+        'image_hash': blob_store().put(image_data),
+        'image_size': len(image_data),
+        'image_data': None,
+        'thumb_hash': None,
+    }
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        columns.update(image_width=img.width, image_height=img.height, image_format=img.format)
+        columns['thumb_hash'] = blob_store().put(make_thumbnail(image_data, image_pipeline().preset))
+    except Exception:
+        pass  # keep the bytes even if Pillow cannot read them; metadata is best effort
+    return columns
+
+def signature_thumbnail(signature):
+    """Open a signature's thumbnail, generating and storing it on first use"""
+    from imaging import make_thumbnail
+    if signature.thumb_hash:
+        try:
+            return blob_store().open(signature.thumb_hash)
+        except FileNotFoundError:
+            pass
+    thumb = make_thumbnail(load_signature_image(signature), image_pipeline().preset)
+    # Only record it if the image was not replaced meanwhile
+    (Signature.query
+     .filter_by(id=signature.id, uploaded_at=signature.uploaded_at)
+     .update({'thumb_hash': blob_store().put(thumb)}))
+    db.session.commit()
+    return io.BytesIO(thumb)
+
+def load_signature_image(signature):
+    """Image bytes for a signature, from the blob store or the legacy column"""
+    if signature.image_hash:
+        try:
+            return blob_store().get(signature.image_hash)
+        except FileNotFoundError:
+            image_data = legacy_image_data(signature)
+            if not image_data:
+                raise
+            return image_data
+    return legacy_image_data(signature)
+
+def legacy_image_data(signature):
+    """The image_data column of a signature, which may have been left unloaded and closed off from the session"""
+    if 'image_data' in inspect(signature).unloaded:
+        return db.session.query(Signature.image_data).filter_by(id=signature.id).scalar()
+    return signature.image_data
+
+def load_signature_images(ids):
+    """Return {signature id: image bytes} for many signatures with at most two queries"""
+    images = {}
+    legacy = []
+    for sig_id, key in db.session.query(Signature.id, Signature.image_hash).filter(Signature.id.in_(ids)):
+        if not key:
+            legacy.append(sig_id)
+            continue
+        try:
+            images[sig_id] = blob_store().get(key)
+        except FileNotFoundError:
+            legacy.append(sig_id)  # migrate-blobs keeps image_data until told to --clear it
+    if legacy:
+        rows = db.session.query(Signature.id, Signature.image_data).filter(Signature.id.in_(legacy))
+        images.update((sig_id, image_data) for sig_id, image_data in rows if image_data)
+    return images
+
+def store_raw_upload(image_data):
+    """Store an upload as-is and return its Signature columns; the processed image is filled in later"""
+    from PIL import Image
+    img = Image.open(io.BytesIO(image_data))  # parses the header only; raises if this is not an image
+    key = blob_store().put(image_data)
+    return {
+        'image_hash': key,
+        'source_hash': key,
+        'image_size': len(image_data),
+        'image_data': None,
+        'thumb_hash': None,
+        'image_width': img.width,
+        'image_height': img.height,
+        'image_format': img.format,
+        'processing': True,
+        **dict.fromkeys(QUALITY_COLUMNS),  # scored with the processed image
+    }
+
+def processed_image_columns(processed, thumb, width, height, quality):
+    """Store the output of prepare_upload in the blob store and return the Signature columns describing it"""
+    return {
+        'image_hash': blob_store().put(processed),
+        'image_size': len(processed),
+        'image_width': width,
+        'image_height': height,
+        'image_format': 'PNG',
+        'thumb_hash': blob_store().put(thumb),
+        **quality,
+    }
+
+def update_duplicates(hashes=None):
+    """Bring the 'duplicate' quality issue in line with which signatures share an ink_hash.
+    
+    Signatures sharing one with another signature that is not rejected are marked,
+    unless already flagged for something else; marked ones that no longer share it
+    (the other was re-uploaded or rejected) are cleared. Limited to the given hashes
+    if any, which should include the old hash of a signature that was just replaced.
+    Returns how many were marked; the caller commits.
+    """
+    shared = (db.select(Signature.ink_hash)
+              .where(Signature.ink_hash.isnot(None), Signature.status != 'rejected')
+              .group_by(Signature.ink_hash)
+              .having(db.func.count(Signature.id) > 1))
+    mark = (db.update(Signature)
+            .where(Signature.quality_issue.is_(None), Signature.status != 'rejected', Signature.ink_hash.in_(shared)))
+    clear = (db.update(Signature)
+             .where(Signature.quality_issue == 'duplicate',
+                    db.or_(Signature.status == 'rejected', Signature.ink_hash.not_in(shared))))
+    if hashes is not None:
+        mark = mark.where(Signature.ink_hash.in_(hashes))
+        clear = clear.where(Signature.ink_hash.in_(hashes))
+    db.session.execute(clear.values(quality_issue=None).execution_options(synchronize_session=False))
+    return db.session.execute(mark.values(quality_issue='duplicate')
+                              .execution_options(synchronize_session=False)).rowcount
+
+def finish_upload(signature_id, uploaded_at, image_data, pool=None):
+    """Process a stored raw upload (in pool, if given) and swap the result into the signature"""
+    from imaging import prepare_upload
+    try:
+        if pool:
+            prepared, seconds = pool.submit(timed_call, prepare_upload, image_data, image_pipeline()).result()
+        else:
+            prepared, seconds = timed_call(prepare_upload, image_data, image_pipeline())
+        metrics.observe('span_duration_seconds', seconds, 'prepare_upload')
+        # A new uploaded_at gives the processed image its own version, so caches holding the raw one move on
+        columns = processed_image_columns(*prepared)
+        columns['uploaded_at'] = datetime.utcnow()
+    except Exception:
+        app.logger.exception('Processing the upload for signature %s failed; keeping the original', signature_id)
+        columns = {}
+    columns['processing'] = False
+    
+    with app.app_context():
+        # Only if the signature was not replaced by another upload meanwhile
+        updated = Signature.query.filter_by(id=signature_id, uploaded_at=uploaded_at).update(columns)
+        if updated and columns.get('ink_hash'):
+            update_duplicates([columns['ink_hash']])
+        db.session.commit()
+    if updated:
+        invalidate_signature_cache(signature_id, uploaded_at)
+
+# Uploads accepted but not yet processed; when all are taken new uploads get a 503
+upload_slots = threading.BoundedSemaphore(app.config['UPLOAD_QUEUE_LIMIT'])
+
+_upload_pool = None
+_upload_executor = None
+
+def upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = ProcessPoolExecutor(
+            max_workers=app.config['UPLOAD_PROCESSES'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _upload_pool
+
+def queue_upload(signature_id, uploaded_at, image_data):
+    """Process an upload in the background; releases its upload slot when done"""
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(max_workers=app.config['UPLOAD_PROCESSES'], thread_name_prefix='upload')
+    
+    def run():
+        try:
+            finish_upload(signature_id, uploaded_at, image_data, upload_pool())
+        finally:
+            upload_slots.release()
+    _upload_executor.submit(run)
+
+@app.cli.command('process-uploads')
+def process_uploads_command():
+    """Process uploads left unprocessed, e.g. by a restart while they were queued"""
+    rows = (db.session.query(Signature.id, Signature.uploaded_at, Signature.image_hash)
+            .filter(Signature.processing.is_(True))
+            .order_by(Signature.id)
+            .all())
+    for sig_id, uploaded_at, key in rows:
+        finish_upload(sig_id, uploaded_at, blob_store().get(key))
+    click.echo(f'Done: {len(rows)} uploads processed.')
+
+@app.cli.command('compact-signatures')
+@click.option('--batch-size', default=100, help='Signatures re-processed per transaction')
+def compact_signatures_command(batch_size):
+    """Re-process stored signatures with the current image pipeline, keeping results that are smaller"""
+    from imaging import prepare_upload
+    last_id = 0
+    compacted = saved = 0
+    while True:
+        rows = (db.session.query(Signature.id, Signature.uploaded_at, Signature.image_hash, Signature.image_size)
+                .filter(Signature.id > last_id, Signature.image_hash.isnot(None), Signature.processing.isnot(True))
+                .order_by(Signature.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        futures = [upload_pool().submit(prepare_upload, blob_store().get(row.image_hash), image_pipeline()) for row in rows]
+        changed = []
+        for row, future in zip(rows, futures):
+            try:
+                prepared = future.result()
+            except Exception as e:
+                click.echo(f'Skipping signature {row.id}: {e}')
+                continue
+            processed = prepared[0]
+            if len(processed) >= (row.image_size or 0):
+                continue
+            # uploaded_at is the image's version: nudge it so caches pick up the new image, without
+            # changing the upload order or the time shown to anyone
+            columns = processed_image_columns(*prepared)
+            columns['uploaded_at'] = row.uploaded_at + timedelta(microseconds=1)
+            updated = Signature.query.filter_by(id=row.id, uploaded_at=row.uploaded_at).update(columns)
+            if updated:
+                changed.append(row)
+                saved += (row.image_size or 0) - len(processed)
+        # The new scores replaced any duplicate flags
+        update_duplicates()
+        db.session.commit()
+        for row in changed:
+            invalidate_signature_cache(row.id, row.uploaded_at)
+        compacted += len(changed)
+        click.echo(f'Checked up to signature {last_id}: {compacted} compacted, {saved // 1024} KB saved')
+    click.echo(f'Done: {compacted} signatures compacted, {saved // 1024} KB saved.')
+
+@app.cli.command('score-signatures')
+@click.option('--batch-size', default=200, help='Signatures scored per transaction')
+@click.option('--chunk-size', default=25, help='Images scored together by one pool worker')
+@click.option('--rescore', is_flag=True, help='Score every signature again, not only those without a score')
+def score_signatures_command(batch_size, chunk_size, rescore):
+    """Compute quality metrics for stored signatures, e.g. those uploaded before scoring existed.
+
+    Stored images are scored in chunks on the upload pool, each chunk in one
+    vectorized pass, and duplicates are flagged once everything is scored.
+    """
+    from quality import score_image_bytes
+    last_id = 0
+    scored = failed = 0
+    while True:
+        query = (db.session.query(Signature.id, Signature.uploaded_at, Signature.image_hash)
+                 .filter(Signature.id > last_id, Signature.image_hash.isnot(None), Signature.processing.isnot(True)))
+        if not rescore:
+            query = query.filter(Signature.quality_score.is_(None))
+        rows = query.order_by(Signature.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        chunks = list(iter_chunks(rows, chunk_size))
+        futures = [upload_pool().submit(score_image_bytes, [blob_store().get(row.image_hash) for row in chunk])
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for row, scores in zip(chunk, future.result()):
+                if scores is None:
+                    click.echo(f'Skipping signature {row.id}: unreadable image')
+                    failed += 1
+                    continue
+                # Only if the image was not replaced meanwhile; its upload scores the new one
+                scored += Signature.query.filter_by(id=row.id, uploaded_at=row.uploaded_at).update(scores)
+        db.session.commit()
+        click.echo(f'Scored up to signature {last_id}: {scored} scored, {failed} unreadable')
+    duplicates = update_duplicates()
+    db.session.commit()
+    click.echo(f'Done: {scored} signatures scored, {duplicates} flagged as duplicates, {failed} unreadable.')
+
+# Image files the import command picks up; the same list chat-gpt5-condense.py builds packets from
+IMPORT_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff')
+
+def import_ranger_id(filename):
+    """Ranger ID for an imported file, by chat-gpt5-condense.py's signature_name convention: Jane_Doe.png is "Jane Doe"."""
+    return os.path.splitext(os.path.basename(filename))[0].replace('_', ' ').strip()
+
+def iter_import_files(path):
+    """Yield (filename, read) for the signature images in a directory tree or a zip file, in name order"""
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        names = [info.filename for info in archive.infolist()
+                 if not info.is_dir() and info.filename.lower().endswith(IMPORT_EXTENSIONS)
+                 and not info.filename.startswith('__MACOSX/')]
+        for name in sorted(names, key=str.lower):
+            yield name, lambda name=name: archive.read(name)
+        return
+    if not os.path.isdir(path):
+        # e.g. a zip cut short by an interrupted download, which has lost the directory at its end
+        raise click.ClickException(f'{path} is neither a folder nor a readable zip file')
+
+    files = []
+    for folder, _, filenames in os.walk(path):
+        files.extend(os.path.join(folder, f) for f in filenames if f.lower().endswith(IMPORT_EXTENSIONS))
+    for filename in sorted(files, key=lambda f: os.path.basename(f).lower()):
+        def read(filename=filename):
+            with open(filename, 'rb') as f:
+                return f.read()
+        yield filename, read
+
+@app.cli.command('import-signatures')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--batch-size', default=100, help='Signatures processed and inserted per transaction')
+@click.option('--processes', default=os.cpu_count() or 1, help='Image processing worker processes')
+@click.option('--status', type=click.Choice(SIGNATURE_STATUSES), default='pending', help='Status of imported signatures')
+@click.option('--replace', is_flag=True, help='Replace signatures rangers already have with a different image')
+def import_signatures_command(path, batch_size, processes, status, replace):
+    """Import a folder (or zip) of signature images, one per ranger, named after their Ranger ID.
+
+    Files are matched to rangers by name, processed like uploads and inserted a
+    batch per transaction. Files already imported (by content hash) are skipped,
+    so an interrupted import can simply be run again.
+    """
+    from imaging import prepare_upload
+    imported = skipped = failed = 0
+    max_length = Ranger.__table__.c.ranger_id.type.length
+    claimed = {}  # Ranger ID -> the file imported for it, across batches
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for batch in iter_chunks(iter_import_files(path), batch_size):
+            files = {}
+            for filename, read in batch:
+                ranger_id = import_ranger_id(filename)
+                if not ranger_id:
+                    continue
+                if len(ranger_id) > max_length:
+                    click.echo(f'Skipping {filename}: Ranger ID "{ranger_id}" is longer than {max_length} characters')
+                    failed += 1
+                    continue
+                if ranger_id in claimed:
+                    # e.g. Jane_Doe.png and "Jane Doe.jpg", or the same name in two folders; the first one wins
+                    click.echo(f'Skipping {filename}: Ranger ID "{ranger_id}" is already taken by {claimed[ranger_id]}')
+                    failed += 1
+                    continue
+                try:
+                    image_data = read()
+                except (OSError, zipfile.BadZipFile, zlib.error) as e:  # a damaged zip member fails to read like a file
+                    click.echo(f'Skipping {filename}: {e}')
+                    failed += 1
+                    continue
+                claimed[ranger_id] = filename
+                files[ranger_id] = (filename, image_data, hashlib.sha256(image_data).hexdigest())
+
+            rangers = {ranger.ranger_id: ranger for ranger in
+                       Ranger.query
+                       .options(joinedload(Ranger.signature).load_only(Signature.id, Signature.source_hash, Signature.ink_hash))
+                       .filter(Ranger.ranger_id.in_(files))}
+            todo = {}
+            for ranger_id, (filename, image_data, source_hash) in files.items():
+                signature = rangers[ranger_id].signature if ranger_id in rangers else None
+                if signature and (signature.source_hash == source_hash or not replace):
+                    skipped += 1
+                    continue
+                todo[ranger_id] = pool.submit(prepare_upload, image_data, image_pipeline())
+
+            now = datetime.utcnow()
+            hashes = set()
+            for ranger_id, future in todo.items():
+                filename, image_data, source_hash = files[ranger_id]
+                try:
+                    columns = processed_image_columns(*future.result())
+                except Exception as e:
+                    click.echo(f'Skipping {filename}: {e}')
+                    failed += 1
+                    continue
+                columns.update(
+                    source_hash=source_hash, image_data=None, processing=False, uploaded_at=now, status=status,
+                    approved_at=now if status == 'approved' else None,
+                    rejected_at=now if status == 'rejected' else None, rejection_reason=None,
+                )
+                ranger = rangers.get(ranger_id)
+                if ranger is None:
+                    ranger = rangers[ranger_id] = Ranger(ranger_id=ranger_id)
+                    db.session.add(ranger)
+                if ranger.signature:
+                    hashes.add(ranger.signature.ink_hash)  # its old twin may no longer be a duplicate
+                    for column, value in columns.items():
+                        setattr(ranger.signature, column, value)
+                else:
+                    ranger.signature = Signature(**columns)
+                hashes.add(columns['ink_hash'])
+                imported += 1
+            update_duplicates(hashes - {None})
+            db.session.commit()
+            click.echo(f'{imported} imported, {skipped} already present, {failed} failed')
+    click.echo(f'Done: {imported} signatures imported, {skipped} skipped, {failed} failed.')
+
+@app.cli.command('migrate-blobs')
+@click.option('--batch-size', default=100, help='Signatures moved per transaction')
+@click.option('--clear', is_flag=True, help='Empty image_data of signatures whose blobs are confirmed to be in the store')
+def migrate_blobs_command(batch_size, clear):
+    """Copy image_data out of the signatures table into the blob store.
+
+    image_data is kept as a fallback, so nothing is lost if the store turns out
+    not to be persistent. Once the blobs are safely stored, run again with
+    --clear to free the space; only rows whose blobs exist are cleared.
+    """
+    moved = 0
+    while True:
+        rows = (db.session.query(Signature.id, Signature.image_data)
+                .filter(Signature.image_hash.is_(None), Signature.image_data.isnot(None))
+                .order_by(Signature.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        for sig_id, image_data in rows:
+            columns = store_signature_image(image_data)
+            del columns['image_data']
+            Signature.query.filter_by(id=sig_id).update(columns)
+        db.session.commit()
+        moved += len(rows)
+        click.echo(f'Copied {moved} signatures to the blob store')
+    click.echo(f'Done: {moved} signatures copied.')
+    if not clear:
+        return
+
+    last_id = 0
+    cleared = missing = 0
+    while True:
+        rows = (db.session.query(Signature.id, Signature.image_hash, Signature.thumb_hash)
+                .filter(Signature.id > last_id, Signature.image_hash.isnot(None), Signature.image_data.isnot(None))
+                .order_by(Signature.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1].id
+        stored = [row.id for row in rows
+                  if blob_store().exists(row.image_hash) and (not row.thumb_hash or blob_store().exists(row.thumb_hash))]
+        missing += len(rows) - len(stored)
+        if stored:
+            (Signature.query.filter(Signature.id.in_(stored))
+             .update({'image_data': None}, synchronize_session=False))
+        db.session.commit()
+        cleared += len(stored)
+    click.echo(f'Cleared image_data of {cleared} signatures; kept it for {missing} whose blobs are missing.')
+
+def referenced_blobs(keys=None):
+    """Blob keys some signature still points at, limited to the given keys if any"""
+    referenced = set()
+    for column in (Signature.image_hash, Signature.thumb_hash):
+        query = db.session.query(column).filter(column.isnot(None))
+        if keys is not None:
+            query = query.filter(column.in_(keys))
+        referenced.update(key for key, in query.distinct())
+    return referenced
+
+@app.cli.command('gc-blobs')
+@click.option('--grace-hours', default=24, help='Leave blobs written more recently than this alone')
+@click.option('--batch-size', default=500, help='Blobs checked against the database per query')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted')
+def gc_blobs_command(grace_hours, batch_size, dry_run):
+    """Delete blobs no signature points at any more.
+
+    These are raw uploads once processed, and images and thumbnails replaced by a
+    new upload or by compact-signatures. Recent blobs are skipped, as their rows may
+    not be committed yet, and every candidate is checked again right before deleting.
+    """
+    before = time.time() - grace_hours * 3600
+    referenced = referenced_blobs()
+    candidates = [key for key in blob_store().keys(before=before) if key not in referenced]
+    db.session.close()
+    deleted = 0
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        still_referenced = referenced_blobs(batch)
+        db.session.close()
+        for key in batch:
+            if key in still_referenced:
+                continue
+            if not dry_run:
+                blob_store().delete(key)
+            deleted += 1
+    verb = 'Would delete' if dry_run else 'Deleted'
+    click.echo(f'{verb} {deleted} unreferenced blobs; {len(referenced)} are in use.')
+
+def signature_version(uploaded_at):
+    """Version token for a signature image; changes whenever a new image is uploaded"""
+    return uploaded_at.strftime('%Y%m%d%H%M%S%f') if uploaded_at else '0'
+
+def pdf_image_cache():
+    return ImageCache(os.path.join(app.config['PDF_CACHE_DIR'], PDF_LAYOUT.key))
+
+def pdf_page_cache():
+    return PageCache(os.path.join(app.config['PDF_CACHE_DIR'], 'pages', PDF_LAYOUT.key))
+
+_image_cache = None
+
+def image_cache():
+    """Byte-bounded LRU of signature images, in front of the shared CACHE_URL backend if one is set"""
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = open_cache(app.config['CACHE_MAX_BYTES'], app.config['CACHE_URL'])
+    return _image_cache
+
+# What gets cached per signature version: the uploaded image, its thumbnail and its print-ready encoding
+CACHED_IMAGE_KINDS = ('full', 'thumb', f'pdf-{PDF_LAYOUT.key}')
+
+def image_cache_key(kind, signature_id, uploaded_at):
+    return f'{kind}:{signature_id}:{signature_version(uploaded_at)}'
+
+def invalidate_signature_cache(signature_id, uploaded_at):
+    image_cache().delete(*(image_cache_key(kind, signature_id, uploaded_at) for kind in CACHED_IMAGE_KINDS))
+
+@event.listens_for(OrmSession, 'before_flush')
+def collect_changed_signatures(session, flush_context, instances):
+    """Remember which cached signature versions a flush replaces (upload) or touches (approve/reject)"""
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Signature) and obj.id is not None:
+            history = inspect(obj).attrs.uploaded_at.history
+            uploaded_at = history.deleted[0] if history.deleted else obj.uploaded_at
+            session.info.setdefault('changed_signatures', set()).add((obj.id, uploaded_at))
+
+@event.listens_for(OrmSession, 'after_commit')
+def invalidate_changed_signatures(session):
+    for signature_id, uploaded_at in session.info.pop('changed_signatures', ()):
+        invalidate_signature_cache(signature_id, uploaded_at)
+
+@event.listens_for(OrmSession, 'after_rollback')
+def forget_changed_signatures(session):
+    session.info.pop('changed_signatures', None)
+
+def cached_signature_image(signature, kind='full'):
+    """Bytes of a signature image (kind 'full' or 'thumb'), served from the image cache when possible"""
+    def load():
+        if kind == 'thumb':
+            with signature_thumbnail(signature) as f:
+                return f.read()
+        return load_signature_image(signature)
+    return image_cache().get_or_set(image_cache_key(kind, signature.id, signature.uploaded_at), load)
+
+def cached_pdf_image(cache, signature_id, uploaded_at):
+    """Print-ready image from the image cache, falling back to the on-disk PDF cache"""
+    key = image_cache_key(CACHED_IMAGE_KINDS[2], signature_id, uploaded_at)
+    data = image_cache().get(key)
+    if data is not None:
+        return PdfImage.from_bytes(data)
+    image = cache.get(signature_id, signature_version(uploaded_at))
+    if image is not None:
+        image_cache().set(key, image.to_bytes())
+    return image
+
+_render_pool = None
+
+def render_pool():
+    """Process pool for preparing print-ready images, or None to work in-process"""
+    global _render_pool
+    if _render_pool is None and app.config['PDF_RENDER_PROCESSES'] > 1:
+        # spawn rather than fork: the pool may be started from an export thread
+        _render_pool = ProcessPoolExecutor(
+            max_workers=app.config['PDF_RENDER_PROCESSES'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _render_pool
+
+def cache_pdf_images(rows, cache=None):
+    """Prepare and cache print-ready images for (id, uploaded_at, image_data) rows"""
+    cache = cache or pdf_image_cache()
+    versions = {sig_id: uploaded_at for sig_id, uploaded_at, _ in rows}
+    items = [(sig_id, image_data) for sig_id, _, image_data in rows]
+    # Only worth shipping to other processes when there is more than a page of work
+    pool = render_pool() if len(items) > PDF_LAYOUT.cells_per_page else None
+    
+    images = {}
+    prepared = prepare_images(items, PDF_LAYOUT.pixel_box(), PDF_LAYOUT.cells_per_page,
+                              pool, window=2 * app.config['PDF_RENDER_PROCESSES'])
+    while True:
+        # Time each image as it arrives: decoding and downscaling, or waiting for a pool worker to do it
+        with metrics.span('span_duration_seconds', 'pdf_prepare_image'):
+            sig_id, image = next(prepared, (None, None))
+        if sig_id is None:
+            break
+        if image is None:
+            continue
+        images[sig_id] = image
+        image_cache().set(image_cache_key(CACHED_IMAGE_KINDS[2], sig_id, versions[sig_id]), image.to_bytes())
+        try:
+            cache.put(sig_id, signature_version(versions[sig_id]), image)
+        except OSError:
+            pass  # still usable for this export, just not cached
+    return images
+
+def iter_approved_versions(batch_size=None):
+    """Yield (id, uploaded_at) for approved signatures in id order, one keyset batch at a time"""
+    batch_size = batch_size or app.config['PDF_BATCH_SIZE']
+    last_id = 0
+    while True:
+        batch = (db.session.query(Signature.id, Signature.uploaded_at)
+                 .filter(Signature.status == 'approved', Signature.id > last_id)
+                 .order_by(Signature.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield from batch
+
+def iter_packet_cells(versions, batch_size=None):
+    """Yield packet cells for (id, uploaded_at) rows, a batch at a time.
+
+    Image data is fetched (in one query per batch) only for signatures whose
+    print-ready image is not cached yet.
+    """
+    batch_size = batch_size or app.config['PDF_BATCH_SIZE']
+    cache = pdf_image_cache()
+    for batch in iter_chunks(versions, batch_size):
+        images = {sig_id: cached_pdf_image(cache, sig_id, uploaded_at) for sig_id, uploaded_at in batch}
+        missing = [sig_id for sig_id, image in images.items() if image is None]
+        if missing:
+            versions = dict(batch)
+            rows = [(sig_id, versions[sig_id], image_data) for sig_id, image_data in load_signature_images(missing).items()]
+            images.update(cache_pdf_images(rows, cache))
+
+        for sig_id, _ in batch:
+            yield Cell(images.get(sig_id))
+
+def packet_fingerprint(versions):
+    """Hash of (id, uploaded_at) rows in order; equal fingerprints render identical packets (or pages)"""
+    digest = hashlib.sha256(PDF_LAYOUT.key.encode())
+    for sig_id, uploaded_at in versions:
+        digest.update(b'%d:%s;' % (sig_id, signature_version(uploaded_at).encode()))
+    return digest.hexdigest()
+
+def iter_packet_pages(versions, batch_size=None):
+    """Yield laid-out packet pages for (id, uploaded_at) rows.
+
+    A page is keyed by the fingerprint of the signatures on it, so it is only
+    laid out again (and its images only looked up) when one of them was added,
+    removed or re-uploaded; every other page comes straight from the page cache.
+    """
+    batch_size = batch_size or app.config['PDF_BATCH_SIZE']
+    cache = pdf_page_cache()
+    pages_per_batch = max(1, batch_size // PDF_LAYOUT.cells_per_page)
+    for pages in iter_chunks(iter_chunks(versions, PDF_LAYOUT.cells_per_page), pages_per_batch):
+        keys = [packet_fingerprint(page) for page in pages]
+        fragments = [cache.get(key) for key in keys]
+        stale = [row for page, fragment in zip(pages, fragments) if fragment is None for row in page]
+        cells = iter_packet_cells(stale, batch_size)
+
+        for page, key, fragment in zip(pages, keys, fragments):
+            if fragment is None:
+                page_cells = list(islice(cells, len(page)))
+                with metrics.span('span_duration_seconds', 'pdf_build_page'):
+                    fragment = build_page(page_cells, PDF_LAYOUT)
+                metrics.inc('pdf_pages_total', 'rendered')
+                if fragment.complete:
+                    try:
+                        cache.put(key, fragment)
+                    except OSError:
+                        pass  # still usable for this export, just not cached
+            else:
+                metrics.inc('pdf_pages_total', 'cached')
+            yield fragment
+
+def prune_page_cache(versions):
+    """Drop cached pages that are not part of the packet for these (id, uploaded_at) rows"""
+    pdf_page_cache().prune({packet_fingerprint(page) for page in iter_chunks(versions, PDF_LAYOUT.cells_per_page)})
+
+_export_executor = None
+
+def export_executor():
+    global _export_executor
+    if _export_executor is None:
+        _export_executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'], thread_name_prefix='pdf-export')
+    return _export_executor
+
+def run_export_job(job_id, versions):
+    """Render a queued export job to EXPORT_DIR, recording progress on the job row"""
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        job.status = 'running'
+        db.session.commit()
+
+        path = export_path(job_id)
+        tmp_path = path + '.part'
+        last_update = time.monotonic()
+
+        def progress(pages_done):
+            nonlocal last_update
+            # Throttle progress writes; pollers only need roughly once a second
+            if time.monotonic() - last_update >= 1:
+                ExportJob.query.filter_by(id=job_id).update({'pages_done': pages_done})
+                db.session.commit()
+                last_update = time.monotonic()
+
+        try:
+            os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                for chunk in render_pages(iter_packet_pages(versions), PDF_LAYOUT, progress=progress):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+            prune_page_cache(versions)
+            job.status = 'done'
+            job.pages_done = job.pages_total
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(ExportJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        prune_exports()
+
+def export_path(job_id):
+    return os.path.join(app.config['EXPORT_DIR'], f'export-{job_id}.pdf')
+
+def prune_exports(keep=5):
+    """Delete all but the most recent finished export files"""
+    old_jobs = ExportJob.query.filter_by(status='done').order_by(ExportJob.id.desc()).offset(keep).all()
+    for job in old_jobs:
+        if os.path.exists(export_path(job.id)):
+            os.remove(export_path(job.id))
+        job.status = 'expired'
+    db.session.commit()
+
+def export_job_json(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'pages_done': job.pages_done,
+        'pages_total': job.pages_total,
+        'signatures': job.signature_count,
+        'error': job.error,
+        'status_url': url_for('export_job_status', job_id=job.id),
+        'download_url': url_for('download_export', job_id=job.id) if job.status == 'done' else None,
+    }
+
+# Moderation actions and the status each one sets
+MODERATION_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+MAX_MODERATION_IDS = 10000
+
+def moderate_signatures(action, condition, reason=None):
+    """Apply a moderation action to every signature matching condition in one UPDATE.
+
+    Signatures already in the target status are left alone. Returns the
+    (id, uploaded_at) rows that changed; the caller commits.
+    """
+    now = datetime.utcnow()
+    status = MODERATION_ACTIONS[action]
+    if status == 'approved':
+        columns = {'status': status, 'approved_at': now, 'rejected_at': None, 'rejection_reason': None}
+    else:
+        columns = {'status': status, 'rejected_at': now, 'approved_at': None, 'rejection_reason': reason}
+    statement = (db.update(Signature)
+                 .where(condition, Signature.status != status)
+                 .values(columns)
+                 .returning(Signature.id, Signature.uploaded_at, Signature.ink_hash)
+                 .execution_options(synchronize_session=False))
+    rows = db.session.execute(statement).all()
+    # Rejecting (or approving a rejected signature) changes which signatures are duplicates
+    hashes = {ink_hash for _, _, ink_hash in rows if ink_hash}
+    if hashes:
+        update_duplicates(hashes if len(hashes) <= MAX_MODERATION_IDS else None)
+    return [(sig_id, uploaded_at) for sig_id, uploaded_at, _ in rows]
+
+def warm_pdf_images(versions):
+    """Render print-ready images for newly approved (id, uploaded_at) rows ahead of the next export"""
+    with app.app_context():
+        try:
+            for _ in iter_packet_cells(versions):
+                pass
+        except Exception:
+            app.logger.exception('Pre-rendering %d approved signatures failed', len(versions))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    metrics.inc('db_queries_total')
+    metrics.inc('db_query_seconds_total', amount=seconds)
+    # Kept in the WSGI environ rather than g, so queries made while streaming a response still count
+    stats = request.environ.get('metrics.stats') if has_request_context() else None
+    if stats is not None:
+        stats['queries'] += 1
+        stats['db_seconds'] += seconds
+
+# cProfile can only profile one request at a time
+profile_lock = threading.Lock()
+
+@app.before_request
+def start_request_metrics():
+    request.environ['metrics.stats'] = {'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0}
+    if request.args.get('profile') == '1' and session.get('admin_authenticated'):
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({'error': 'Another request is being profiled'}), 409
+        profiler = request.environ['metrics.profiler'] = cProfile.Profile()
+        profiler.enable()
+
+@app.after_request
+def finish_request_metrics(response):
+    profiler = request.environ.pop('metrics.profiler', None)
+    if profiler is not None:
+        try:
+            if response.is_streamed:
+                response.get_data()  # run the whole body, e.g. a PDF, under the profiler
+        finally:
+            profiler.disable()
+            profile_lock.release()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(80)
+        response = Response(output.getvalue(), mimetype='text/plain')
+
+    stats = request.environ.get('metrics.stats')
+    if stats is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, status = request.method, str(response.status_code)
+
+        def record():
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - stats['start'], route, method, status)
+            metrics.observe('http_request_queries', stats['queries'], route)
+            metrics.observe('http_request_db_seconds', stats['db_seconds'], route)
+        if response.direct_passthrough:
+            record()  # file responses skip close callbacks
+        else:
+            # Runs once the body has been sent, so streamed responses are timed in full
+            response.call_on_close(record)
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-def process_signature_image(file):
-    """Process and optimize signature image"""
-    img = Image.open(file)
+def upsert_ranger(ranger_id):
+    """Return (primary key, created) for a Ranger ID, creating the ranger if it is new.
     
-    # Convert to RGB if needed
-    if img.mode in ('RGBA', 'LA'):
-        bg = Image.new('RGB', img.size, (255, 255, 255))
-        if img.mode == 'RGBA':
-            bg.paste(img, mask=img.split()[3])
-        else:
-            bg.paste(img, mask=img.split()[1])
-        img = bg
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    # Resize if too large (max 800x400)
-    max_width, max_height = 800, 400
-    if img.width > max_width or img.height > max_height:
-        img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-    
-    # Save to bytes
-    output = io.BytesIO()
-    img.save(output, format='PNG', optimize=True)
-    output.seek(0)
-    return output.read()
+    One INSERT ... ON CONFLICT ... RETURNING statement, so concurrent first logins
+    with the same ID cannot race on the unique constraint. The caller commits.
+    """
+    now = datetime.utcnow()
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(Ranger).values(ranger_id=ranger_id, created_at=now)
+    # A no-op update rather than DO NOTHING, so RETURNING also yields an existing row
+    statement = (statement
+                 .on_conflict_do_update(index_elements=[Ranger.ranger_id], set_={'created_at': Ranger.created_at})
+                 .returning(Ranger.id, Ranger.created_at))
+    ranger_pk, created_at = db.session.execute(statement).one()
+    return ranger_pk, created_at == now
+
+# What the dashboard shows, as kept in the session. The rejection reason is left out: it is free text of
+# any length and the session is a cookie, so it is read from the database when it is displayed
+RangerIdentity = namedtuple('RangerIdentity', 'id ranger_id signature')
+SignatureSummary = namedtuple('SignatureSummary', 'id ranger_id status processing uploaded_at approved_at '
+                                                  'rejected_at updated_at')
+SUMMARY_TIMES = ('uploaded_at', 'approved_at', 'rejected_at', 'updated_at')
+
+def remember_signature(signature):
+    """Keep a summary of the logged-in ranger's signature (or None) in their session"""
+    if signature is None:
+        session['signature'] = None
+    else:
+        session['signature'] = {field: getattr(signature, field) for field in SignatureSummary._fields}
+        session['signature']['processing'] = bool(signature.processing)
+        # isoformat keeps the microseconds the session's own datetime encoding would drop
+        session['signature'].update((field, isoformat(session['signature'][field])) for field in SUMMARY_TIMES)
+    session['signature_checked'] = time.time()
+
+def forget_signature():
+    session.pop('signature', None)
+    session.pop('signature_checked', None)
+
+def session_signature():
+    """The logged-in ranger's SignatureSummary, or None if they have not uploaded one.
+    
+    Comes from the session while it is less than SESSION_STATUS_TTL seconds old;
+    uploads refresh it right away, changes made by admins within that time.
+    """
+    if 'signature' not in session or time.time() - session.get('signature_checked', 0) > app.config['SESSION_STATUS_TTL']:
+        remember_signature(Signature.query
+                           .options(load_only(*REPORT_COLUMNS, Signature.processing))
+                           .filter_by(ranger_id=session['ranger_id'])
+                           .first())
+    summary = session['signature']
+    if summary is None:
+        return None
+    # Sessions written by older versions may hold other fields
+    return SignatureSummary(**{field: datetime.fromisoformat(value) if field in SUMMARY_TIMES and value else value
+                               for field, value in summary.items() if field in SignatureSummary._fields})
+
+def rejection_reason(signature):
+    """Why the given SignatureSummary was rejected, or None if it was not"""
+    if signature is None or signature.status != 'rejected':
+        return None
+    return db.session.query(Signature.rejection_reason).filter_by(id=signature.id).scalar()
 
 @app.route('/')
 def index():
@@ -94,16 +1258,17 @@ def login():
             flash('Please enter your Ranger ID', 'error')
             return redirect(url_for('login'))
         
-        ranger = Ranger.query.filter_by(ranger_id=ranger_id).first()
+        # Create new ranger if ID doesn't exist
+        ranger_pk, created = upsert_ranger(ranger_id)
+        db.session.commit()
         
-        if not ranger:
-            # Create new ranger if ID doesn't exist
-            ranger = Ranger(ranger_id=ranger_id)
-            db.session.add(ranger)
-            db.session.commit()
+        session['ranger_id'] = ranger_pk
+        session['ranger_login'] = ranger_id
+        if created:
+            remember_signature(None)  # nothing to look up until they upload
             flash('Welcome! Please upload your signature.', 'success')
-        
-        session['ranger_id'] = ranger.id
+        else:
+            forget_signature()
         return redirect(url_for('ranger_dashboard'))
     
     return render_template('login.html')
@@ -111,6 +1276,8 @@ def login():
 @app.route('/logout')
 def logout():
     session.pop('ranger_id', None)
+    session.pop('ranger_login', None)
+    forget_signature()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
@@ -120,13 +1287,62 @@ def ranger_dashboard():
         flash('Please log in first.', 'error')
         return redirect(url_for('login'))
     
-    ranger = Ranger.query.get(session['ranger_id'])
-    if not ranger:
-        session.pop('ranger_id', None)
-        flash('Invalid session. Please log in again.', 'error')
-        return redirect(url_for('login'))
+    if 'ranger_login' not in session:
+        # Logged in before identities were kept in the session
+        ranger = db.session.get(Ranger, session['ranger_id'])
+        if not ranger:
+            session.pop('ranger_id', None)
+            flash('Invalid session. Please log in again.', 'error')
+            return redirect(url_for('login'))
+        session['ranger_login'] = ranger.ranger_id
+    
+    signature = session_signature()
+    ranger = RangerIdentity(session['ranger_id'], session['ranger_login'], signature)
+    return render_template('dashboard.html', ranger=ranger, status_etag=status_etag(signature),
+                           rejection_reason=rejection_reason(signature))
+
+def status_etag(signature):
+    """Changes whenever anything about a signature does: a new image, a status change, processing finishing"""
+    if signature is None:
+        return 'none'
+    return f'{signature.id}-{signature_version(signature.updated_at or signature.uploaded_at)}'
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+@app.route('/status')
+def signature_status():
+    """The logged-in ranger's signature status as JSON; answers 304 to If-None-Match while nothing changed.
+    
+    Served from the session for up to SESSION_STATUS_TTL seconds, so most polls
+    never reach the database; an admin's decision shows up after at most that long.
+    """
+    if 'ranger_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
     
-    return render_template('dashboard.html', ranger=ranger)
+    signature = session_signature()
+    etag = status_etag(signature)
+    if not is_resource_modified(request.environ, etag=etag):
+        response = Response(status=304)
+    elif signature is None:
+        response = jsonify({'status': None, 'version': etag})
+    else:
+        reason = rejection_reason(signature)
+        response = jsonify({
+            'status': signature.status,
+            'processing': bool(signature.processing),
+            'uploaded_at': isoformat(signature.uploaded_at),
+            'approved_at': isoformat(signature.approved_at),
+            'rejected_at': isoformat(signature.rejected_at),
+            'rejection_reason': reason,
+            'version': etag,
+            'image_url': signature_url(signature),
+            'html': render_template('_signature_status.html', signature=signature, rejection_reason=reason),
+        })
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
 
 @app.route('/upload', methods=['POST'])
 def upload_signature():
@@ -144,44 +1360,245 @@ def upload_signature():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, or GIF'}), 400
     
+    return save_upload(file.read)
+
+def save_upload(read):
+    """Store the logged-in ranger's new signature image, given a function returning its bytes, and queue its processing"""
+    if not upload_slots.acquire(blocking=False):
+        response = jsonify({'error': 'The server is busy processing other uploads. Please try again in a few seconds.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(app.config['UPLOAD_RETRY_AFTER'])
+        return response
+    
+    queued = False
     try:
-        # Process image
-        image_data = process_signature_image(file)
+        image_data = read()
+        try:
+            # Store the upload as-is by content hash; resizing and re-encoding happen in the upload pool
+            image = store_raw_upload(image_data)
+        except Exception:
+            return jsonify({'error': 'Invalid image file'}), 400
         
-        ranger = Ranger.query.get(session['ranger_id'])
-        
-        # Update or create signature
-        if ranger.signature:
-            ranger.signature.image_data = image_data
-            ranger.signature.uploaded_at = datetime.utcnow()
+        # Update or create signature; the ranger's own row is not needed, its key is in the session
+        signature = Signature.query.filter_by(ranger_id=session['ranger_id']).first()
+        replaced_hash = signature.ink_hash if signature else None
+        if signature:
+            for column, value in image.items():
+                setattr(signature, column, value)
+            signature.uploaded_at = datetime.utcnow()
             # Reset approval status when uploading new signature
-            ranger.signature.status = 'pending'
-            ranger.signature.approved_at = None
-            ranger.signature.rejected_at = None
-            ranger.signature.rejection_reason = None
+            signature.status = 'pending'
+            signature.approved_at = None
+            signature.rejected_at = None
+            signature.rejection_reason = None
         else:
-            signature = Signature(ranger_id=ranger.id, image_data=image_data, status='pending')
+            signature = Signature(ranger_id=session['ranger_id'], status='pending', **image)
             db.session.add(signature)
         
+        db.session.flush()
+        if replaced_hash:
+            update_duplicates([replaced_hash])  # a signature that matched the old image is no longer a duplicate
+        remember_signature(signature)
+        # Read before committing, which would expire them and cost another query
+        signature_id, uploaded_at = signature.id, signature.uploaded_at
         db.session.commit()
+        queue_upload(signature_id, uploaded_at, image_data)
+        queued = True
         flash('Signature uploaded successfully!', 'success')
         return jsonify({'success': True, 'redirect': url_for('ranger_dashboard')})
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    finally:
+        if not queued:
+            upload_slots.release()
+
+# Resumable uploads: the dashboard creates an upload, sends the file in chunks (resending any
+# that fail) and then finishes it, which stores it like a plain /upload. Each chunk is streamed
+# to its own file named after its offset, so a resent chunk simply replaces its earlier copy and
+# any web worker can carry on an upload another one started.
+CHUNKED_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+def chunked_upload_dir(upload_id):
+    return os.path.join(app.config['UPLOAD_CHUNK_DIR'], upload_id)
+
+def load_chunked_upload(upload_id):
+    """The logged-in ranger's chunked upload with this id, as {'ranger', 'size'}; None if there is none"""
+    if not CHUNKED_UPLOAD_ID.match(upload_id):
+        return None
+    try:
+        with open(os.path.join(chunked_upload_dir(upload_id), 'upload.json')) as f:
+            upload = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return upload if upload['ranger'] == session.get('ranger_id') else None
+
+def chunked_upload_chunks(upload_id):
+    """(offset, path) of the chunks received so far, in order"""
+    folder = chunked_upload_dir(upload_id)
+    return sorted((int(name[:-6]), os.path.join(folder, name)) for name in os.listdir(folder) if name.endswith('.chunk'))
+
+def chunked_upload_offset(upload_id):
+    """How many bytes from the start have arrived, i.e. where the next chunk goes"""
+    offset = 0
+    for start, path in chunked_upload_chunks(upload_id):
+        if start == offset:
+            offset += os.path.getsize(path)
+    return offset
+
+def prune_chunked_uploads():
+    """Delete chunked uploads nobody has added to for UPLOAD_CHUNK_TTL"""
+    cutoff = time.time() - app.config['UPLOAD_CHUNK_TTL'].total_seconds()
+    try:
+        names = os.listdir(app.config['UPLOAD_CHUNK_DIR'])
+    except FileNotFoundError:
+        return
+    for name in names:
+        folder = os.path.join(app.config['UPLOAD_CHUNK_DIR'], name)
+        try:
+            if max(os.path.getmtime(os.path.join(folder, f)) for f in os.listdir(folder) + ['.']) < cutoff:
+                shutil.rmtree(folder, ignore_errors=True)
+        except OSError:
+            pass  # being finished or pruned by another worker
+
+@app.route('/upload/chunked', methods=['POST'])
+def create_chunked_upload():
+    """Start a resumable upload of {'filename', 'size'}; returns where to send its chunks"""
+    if 'ranger_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    filename, size = data.get('filename') or '', data.get('size')
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, or GIF'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size must be the file size in bytes'}), 400
+    if size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File too large (max 5MB)'}), 413
+    
+    prune_chunked_uploads()
+    upload_id = secrets.token_hex(16)
+    os.makedirs(chunked_upload_dir(upload_id))
+    with open(os.path.join(chunked_upload_dir(upload_id), 'upload.json'), 'w') as f:
+        json.dump({'ranger': session['ranger_id'], 'size': size}, f)
+    return jsonify({
+        'url': url_for('append_upload_chunk', upload_id=upload_id),
+        'offset': 0,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+    }), 201
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """How much of an upload has arrived, to resume it after a dropped connection"""
+    upload = load_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'offset': chunked_upload_offset(upload_id), 'size': upload['size']})
+
+@app.route('/upload/chunked/<upload_id>', methods=['PATCH'])
+def append_upload_chunk(upload_id):
+    """Receive the chunk starting at the Upload-Offset header, streaming the request body to disk"""
+    upload = load_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    offset = chunked_upload_offset(upload_id)
+    if request.headers.get('Upload-Offset', type=int) != offset:
+        return jsonify({'error': 'Chunk does not start where the upload left off', 'offset': offset}), 409
+    length = request.content_length
+    if not length or offset + length > upload['size']:
+        return jsonify({'error': 'Chunk does not fit the upload', 'offset': offset}), 400
+    
+    folder = chunked_upload_dir(upload_id)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(request.stream, f, 64 * 1024)
+            received = f.tell()
+        if received != length:
+            raise ClientDisconnected()
+        # Atomic, so a chunk is either all there or not at all, and a resent one replaces it
+        os.replace(tmp, os.path.join(folder, f'{offset:010d}.chunk'))
+    except (OSError, ClientDisconnected):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return jsonify({'error': 'Chunk incomplete', 'offset': offset}), 400
+    return jsonify({'offset': chunked_upload_offset(upload_id), 'size': upload['size']})
+
+@app.route('/upload/chunked/<upload_id>', methods=['POST'])
+def finish_chunked_upload(upload_id):
+    """Store a fully received upload as the ranger's signature, like /upload; 503 means finish again later"""
+    upload = load_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = chunked_upload_offset(upload_id)
+    if offset != upload['size']:
+        return jsonify({'error': 'Upload incomplete', 'offset': offset}), 409
+    
+    def read():
+        parts = []
+        for _, path in chunked_upload_chunks(upload_id):
+            with open(path, 'rb') as f:
+                parts.append(f.read())
+        return b''.join(parts)[:upload['size']]
+    
+    response = app.make_response(save_upload(read))
+    if response.status_code == 200:
+        shutil.rmtree(chunked_upload_dir(upload_id), ignore_errors=True)
+    return response
 
 @app.route('/signature/<int:ranger_id>')
 def view_signature(ranger_id):
-    signature = Signature.query.filter_by(ranger_id=ranger_id).first()
+    signature = (Signature.query
+                 .options(load_only(Signature.id, Signature.uploaded_at, Signature.image_hash,
+                                    Signature.image_format, Signature.thumb_hash))
+                 .filter_by(ranger_id=ranger_id)
+                 .first())
     if not signature:
         return 'No signature found', 404
+    if signature.image_hash:
+        # Everything needed is loaded: give the connection back to the pool before reading the blob store
+        db.session.close()
     
-    return send_file(
-        io.BytesIO(signature.image_data),
-        mimetype='image/png',
-        as_attachment=False
-    )
+    # Images never change in place (a new upload bumps uploaded_at), so id + version is a strong validator
+    thumb = request.args.get('size') == 'thumb'
+    version = signature_version(signature.uploaded_at)
+    etag = f'{signature.id}-{version}-{"thumb" if thumb else "full"}'
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=signature.uploaded_at):
+        response = Response(status=304)
+    else:
+        try:
+            image = cached_signature_image(signature, 'thumb' if thumb else 'full')
+        except FileNotFoundError:
+            image = None
+        if not image:
+            return 'No signature found', 404
+        if thumb or not signature.image_hash:
+            mimetype = 'image/png'
+        else:
+            mimetype = f'image/{(signature.image_format or "png").lower()}'
+        response = send_file(io.BytesIO(image), mimetype=mimetype, as_attachment=False, conditional=False)
+    
+    response.set_etag(etag)
+    response.last_modified = signature.uploaded_at
+    if request.args.get('v') == version:
+        # Versioned URL: its content can never change, so browsers need not ask again
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True  # always revalidate; usually a 304
+    return response
+
+def signature_url(signature, size=None):
+    """Versioned, long-cacheable URL of a signature image (size='thumb' for the small variant)"""
+    return url_for('view_signature', ranger_id=signature.ranger_id, v=signature_version(signature.uploaded_at), size=size)
+
+app.jinja_env.globals['signature_url'] = signature_url
+app.jinja_env.globals['isoformat'] = isoformat
 
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
@@ -208,8 +1625,186 @@ def report():
         flash('Please login to view signatures', 'error')
         return redirect(url_for('admin_login'))
     
-    rangers = Ranger.query.join(Signature).all()
-    return render_template('report.html', rangers=rangers)
+    status, quality, sort = report_filters()
+    try:
+        rangers, next_cursor = report_page(status, request.args.get('after'), quality=quality, sort=sort)
+    except ValueError:
+        rangers, next_cursor = report_page(status, quality=quality, sort=sort)
+    next_url = (url_for('report_signatures', status=status, quality=quality, sort=sort, after=next_cursor)
+                if next_cursor else None)
+    return render_template('report.html', rangers=rangers, counts=status_counts(), status=status, next_url=next_url,
+                           quality=quality, sort=sort, quality_counts=quality_counts(status),
+                           clean_pending=quality_counts('pending')['clean'],
+                           loaded_at=datetime.utcnow().isoformat(), changes_cursor=change_feed_start(),
+                           sheet=contact_sheet_map([ranger.signature for ranger in rangers]))
+
+def report_filters():
+    """The report's status, quality and sort choices from the query string, None where absent or invalid"""
+    status = request.args.get('status') if request.args.get('status') in SIGNATURE_STATUSES else None
+    quality = request.args.get('quality') if quality_condition(request.args.get('quality')) is not None else None
+    sort = 'quality' if request.args.get('sort') == 'quality' else None
+    return status, quality, sort
+
+@app.route('/report/signatures')
+def report_signatures():
+    """Next page of report cards as JSON, for infinite scroll"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status, quality, sort = report_filters()
+    try:
+        rangers, next_cursor = report_page(status, request.args.get('after'), request.args.get('per_page', type=int),
+                                           quality, sort)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    sheet = contact_sheet_map([ranger.signature for ranger in rangers])
+    
+    return jsonify({
+        'signatures': [{
+            'id': ranger.signature.id,
+            'ranger_id': ranger.ranger_id,
+            'status': ranger.signature.status,
+            'uploaded_at': ranger.signature.uploaded_at.isoformat(),
+            'rejection_reason': ranger.signature.rejection_reason,
+            'quality_score': ranger.signature.quality_score,
+            'quality_issue': ranger.signature.quality_issue,
+            'image_url': signature_url(ranger.signature, 'thumb'),
+        } for ranger in rangers],
+        'html': render_template('_signature_cards.html', rangers=rangers, sheet=sheet),
+        'sheet': sheet,
+        'next_cursor': next_cursor,
+        'next_url': (url_for('report_signatures', status=status, quality=quality, sort=sort, after=next_cursor)
+                     if next_cursor else None),
+    })
+
+def contact_sheet_version(ids, signatures):
+    """Version token of the contact sheet for signature ids, given {id: Signature} for those that exist"""
+    from imaging import SHEET_COLUMNS, THUMBNAIL_SIZE
+    digest = hashlib.sha256(b'%s:%d:%dx%d;' % (app.config['REPORT_SHEET_FORMAT'].encode(), SHEET_COLUMNS, *THUMBNAIL_SIZE))
+    for sig_id in ids:
+        signature = signatures.get(sig_id)
+        digest.update(b'%d:%s;' % (sig_id, signature_version(signature.uploaded_at).encode() if signature else b'-'))
+    return digest.hexdigest()[:32]
+
+def contact_sheet_map(signatures):
+    """Contact sheets for these signatures, and where each one's thumbnail sits on them.
+    
+    Returns {'sheets': [{url, width, height}], 'tiles': {id: (sheet index, x, y, w, h)}},
+    so a report page loads one image per SHEET_TILES cards instead of one per
+    card. The map is worked out from stored image sizes alone; a sheet is only
+    composited when its URL is fetched, and its URL changes when any member's
+    image does.
+    """
+    from imaging import SHEET_TILES, sheet_tiles, thumbnail_size
+    sheets = []
+    tiles = {}
+    for chunk in iter_chunks([signature for signature in signatures if signature is not None], SHEET_TILES):
+        ids = [signature.id for signature in chunk]
+        boxes, width, height = sheet_tiles([thumbnail_size(s.image_width, s.image_height) for s in chunk])
+        version = contact_sheet_version(ids, {signature.id: signature for signature in chunk})
+        tiles.update((signature.id, (len(sheets), *box)) for signature, box in zip(chunk, boxes))
+        sheets.append({
+            'url': url_for('report_sheet', ids=','.join(map(str, ids)), v=version),
+            'width': width,
+            'height': height,
+        })
+    return {'sheets': sheets, 'tiles': tiles} if sheets else None
+
+@app.route('/report/sheet')
+def report_sheet():
+    """Thumbnails of the signatures in ids (comma-separated), composited into one image in that order"""
+    if not session.get('admin_authenticated'):
+        return 'Unauthorized', 401
+    
+    try:
+        ids = [int(sig_id) for sig_id in request.args.get('ids', '').split(',')]
+    except ValueError:
+        return 'Invalid ids', 400
+    from imaging import SHEET_TILES, contact_sheet
+    if len(ids) > SHEET_TILES:
+        return f'At most {SHEET_TILES} signatures per sheet', 400
+    
+    signatures = {signature.id: signature for signature in
+                  Signature.query
+                  .options(load_only(Signature.id, Signature.ranger_id, Signature.uploaded_at, Signature.image_hash,
+                                     Signature.thumb_hash))
+                  .filter(Signature.id.in_(ids))}
+    # Everything needed is loaded: give the connection back to the pool before reading and compositing
+    db.session.close()
+    version = contact_sheet_version(ids, signatures)
+    
+    if not is_resource_modified(request.environ, etag=version):
+        response = Response(status=304)
+    else:
+        image_format = app.config['REPORT_SHEET_FORMAT']
+        
+        def build():
+            thumbs = []
+            for sig_id in ids:
+                try:
+                    thumbs.append(cached_signature_image(signatures[sig_id], 'thumb') if sig_id in signatures else None)
+                except FileNotFoundError:
+                    thumbs.append(None)
+            with metrics.span('span_duration_seconds', 'contact_sheet'):
+                return contact_sheet(thumbs, image_format, image_pipeline().preset)
+        # Keyed by version, so a sheet is only composited again when one of its signatures gets a new image
+        sheet = image_cache().get_or_set(f'sheet:{version}', build)
+        response = send_file(io.BytesIO(sheet), mimetype=f'image/{image_format.lower()}', conditional=False)
+    
+    response.set_etag(version)
+    if request.args.get('v') == version:
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@app.route('/report/changes')
+def report_changes():
+    """Signatures changed since a cursor, for the report to update cards in place.
+
+    Answers straight away; the report polls it every few seconds, and right
+    after each approval or rejection. The ETag covers the cursor and the
+    changes returned, so an If-None-Match poll that finds nothing new gets a 304.
+    """
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        rangers, cursor = changed_since(request.args.get('since') or change_feed_start())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    etag = cursor
+    if rangers:
+        last = rangers[-1].signature
+        etag += f'.{len(rangers)}.{encode_change_cursor(last.updated_at, last.id)}'
+    
+    if not is_resource_modified(request.environ, etag=etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({
+            'changes': [{
+                'id': ranger.signature.id,
+                'ranger_id': ranger.ranger_id,
+                'status': ranger.signature.status,
+                'uploaded_at': isoformat(ranger.signature.uploaded_at),
+                'updated_at': isoformat(ranger.signature.updated_at),
+                'approved_at': isoformat(ranger.signature.approved_at),
+                'rejected_at': isoformat(ranger.signature.rejected_at),
+                'rejection_reason': ranger.signature.rejection_reason,
+                'quality_score': ranger.signature.quality_score,
+                'quality_issue': ranger.signature.quality_issue,
+                'image_url': signature_url(ranger.signature, 'thumb'),
+                'html': render_template('_signature_cards.html', rangers=[ranger]),
+            } for ranger in rangers],
+            'cursor': cursor,
+            'counts': status_counts() if rangers else None,
+        })
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/approve_signature/<int:signature_id>', methods=['POST'])
 def approve_signature(signature_id):
@@ -221,8 +1816,16 @@ def approve_signature(signature_id):
     signature.approved_at = datetime.utcnow()
     signature.rejected_at = None
     signature.rejection_reason = None
+    if signature.ink_hash:
+        db.session.flush()
+        update_duplicates([signature.ink_hash])  # it counts again if it was rejected before
+    # Read before committing, which would expire them and cost another query
+    version, approved_at = (signature.id, signature.uploaded_at), signature.approved_at
     db.session.commit()
-    return jsonify({'status': 'approved', 'approved_at': signature.approved_at.strftime('%B %d, %Y at %I:%M %p')})
+    
+    # Render the print-ready image in the background so the next PDF export only has to splice it in
+    export_executor().submit(warm_pdf_images, [version])
+    return jsonify({'status': 'approved', 'approved_at': approved_at.strftime('%B %d, %Y at %I:%M %p')})
 
 @app.route('/reject_signature/<int:signature_id>', methods=['POST'])
 def reject_signature(signature_id):
@@ -237,85 +1840,187 @@ def reject_signature(signature_id):
     signature.rejected_at = datetime.utcnow()
     signature.approved_at = None
     signature.rejection_reason = rejection_reason
+    if signature.ink_hash:
+        db.session.flush()
+        update_duplicates([signature.ink_hash])  # a rejected signature no longer makes its twin a duplicate
     db.session.commit()
     return jsonify({'status': 'rejected', 'rejected_at': signature.rejected_at.strftime('%B %d, %Y at %I:%M %p'), 'reason': rejection_reason})
 
+@app.route('/moderate_signatures', methods=['POST'])
+def bulk_moderate_signatures():
+    """Approve or reject many signatures in one transaction.
+
+    The JSON body names an action ('approve' or 'reject', with an optional
+    'reason') and either a list of signature 'ids', or a 'status' whose
+    signatures should all be moderated, optionally only those uploaded no later
+    than 'uploaded_before' (an ISO timestamp, e.g. when the report was loaded)
+    and only those matching a report 'quality' filter (e.g. 'clean').
+    """
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in MODERATION_ACTIONS:
+        return jsonify({'error': 'Action must be approve or reject'}), 400
+    reason = (data.get('reason') or '').strip()
+
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(sig_id, int) for sig_id in ids):
+            return jsonify({'error': 'ids must be a list of signature ids'}), 400
+        if len(ids) > MAX_MODERATION_IDS:
+            return jsonify({'error': f'At most {MAX_MODERATION_IDS} signatures per request'}), 400
+        condition = Signature.id.in_(ids)
+    elif data.get('status') in SIGNATURE_STATUSES:
+        condition = Signature.status == data['status']
+        if data.get('uploaded_before'):
+            try:
+                condition &= Signature.uploaded_at <= datetime.fromisoformat(data['uploaded_before'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid uploaded_before'}), 400
+        if data.get('quality'):
+            quality = quality_condition(data['quality'])
+            if quality is None:
+                return jsonify({'error': 'Invalid quality'}), 400
+            condition &= quality
+    else:
+        return jsonify({'error': 'Give either ids or a status to moderate'}), 400
+
+    try:
+        changed = moderate_signatures(action, condition, reason)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Moderation failed: {str(e)}'}), 500
+
+    # The UPDATE bypasses the ORM flush, so drop cached versions here
+    for sig_id, uploaded_at in changed:
+        invalidate_signature_cache(sig_id, uploaded_at)
+    if action == 'approve' and changed:
+        export_executor().submit(warm_pdf_images, sorted(changed))
+
+    results = {sig_id: MODERATION_ACTIONS[action] for sig_id, _ in changed}
+    if ids is not None:
+        unchanged = {sig_id for (sig_id,) in
+                     db.session.query(Signature.id).filter(Signature.id.in_(set(ids) - set(results)))}
+        for sig_id in ids:
+            results.setdefault(sig_id, 'unchanged' if sig_id in unchanged else 'not_found')
+
+    return jsonify({
+        'action': action,
+        'updated': len(changed),
+        'results': {str(sig_id): result for sig_id, result in results.items()},
+        'counts': status_counts(),
+    })
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    """Hit/miss counters and size of this worker's image cache"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(image_cache().stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, query and stage timings in the Prometheus text format"""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}' and not session.get('admin_authenticated'):
+        return 'Unauthorized', 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/print_pdf')
 def print_pdf():
     if not session.get('admin_authenticated'):
         flash('Please login to generate PDF', 'error')
         return redirect(url_for('admin_login'))
     
-    # Get approved signatures only
-    signatures = Signature.query.filter_by(status='approved').all()
-    
-    if not signatures:
+    # Approved signatures only; the images themselves are fetched batch by batch while streaming
+    if not db.session.query(Signature.query.filter_by(status='approved').exists()).scalar():
         flash('No approved signatures available for printing', 'error')
         return redirect(url_for('report'))
     
-    # PDF generation settings
-    page = landscape(letter)
-    page_w, page_h = page
-    margin = 0.5 * inch
-    gutter = 0.20 * inch
-    target_w = 2.4 * inch
-    target_h = 1.2 * inch
-    
-    # Calculate grid
-    avail_w = page_w - 2 * margin
-    avail_h = page_h - 2 * margin
-    cols = max(1, int((avail_w + gutter) // (target_w + gutter)))
-    rows = max(1, int((avail_h + gutter) // (target_h + gutter)))
-    cell_w = (avail_w - (cols - 1) * gutter) / cols
-    cell_h = (avail_h - (rows - 1) * gutter) / rows
-    cells_per_page = cols * rows
-    
-    # Create PDF
-    pdf_buffer = io.BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=page)
-    c.setTitle("Ranger Signatures")
-    
-    for page_index in range(math.ceil(len(signatures) / cells_per_page)):
-        start = page_index * cells_per_page
-        chunk = signatures[start:start + cells_per_page]
-        
-        for idx, sig in enumerate(chunk):
-            r = idx // cols
-            q = idx % cols
-            x = margin + q * (cell_w + gutter)
-            y_top = page_h - margin - r * (cell_h + gutter)
-            y = y_top - cell_h
-            
-            try:
-                # Load image from database
-                img = Image.open(io.BytesIO(sig.image_data))
-                img_w, img_h = img.size
-                
-                # Fit within cell
-                scale = min(cell_w / img_w, cell_h / img_h)
-                fit_w, fit_h = img_w * scale, img_h * scale
-                
-                # Center within cell
-                img_x = x + (cell_w - fit_w) / 2
-                img_y = y + (cell_h - fit_h) / 2
-                
-                c.drawInlineImage(img, img_x, img_y, width=fit_w, height=fit_h)
-            except Exception as e:
-                # Fallback text
-                c.setFont("Helvetica-Oblique", 8)
-                c.drawString(x + 4, y + cell_h / 2, f"[Error loading signature]")
+    def generate():
+        versions = []
         
-        c.showPage()
+        def record():
+            for version in iter_approved_versions():
+                versions.append(version)
+                yield version
+        yield from render_pages(iter_packet_pages(record()), PDF_LAYOUT)
+        # Only once the whole packet went out; a download cut short leaves the cache alone
+        prune_page_cache(versions)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/pdf',
+        headers={
+            'Content-Disposition': f'attachment; filename=ranger_signatures_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        }
+    )
+
+@app.route('/export_jobs', methods=['POST'])
+def create_export_job():
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Snapshot the approved set; the job renders exactly these signatures
+    versions = list(iter_approved_versions())
+    if not versions:
+        return jsonify({'error': 'No approved signatures available for printing'}), 400
+    fingerprint = packet_fingerprint(versions)
+    
+    # Reuse a finished or in-progress export of the same set
+    recent = datetime.utcnow() - app.config['EXPORT_JOB_TIMEOUT']
+    for job in ExportJob.query.filter_by(fingerprint=fingerprint).order_by(ExportJob.id.desc()):
+        if job.status == 'done' and os.path.exists(export_path(job.id)):
+            return jsonify(export_job_json(job))
+        if job.status in ('queued', 'running') and job.created_at > recent:
+            return jsonify(export_job_json(job)), 202
+    
+    job = ExportJob(
+        fingerprint=fingerprint,
+        signature_count=len(versions),
+        pages_total=math.ceil(len(versions) / PDF_LAYOUT.cells_per_page)
+    )
+    db.session.add(job)
+    db.session.commit()
+    export_executor().submit(run_export_job, job.id, versions)
+    return jsonify(export_job_json(job)), 202
+
+@app.route('/export_jobs/<int:job_id>')
+def export_job_status(job_id):
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = ExportJob.query.get_or_404(job_id)
+    if job.status in ('queued', 'running') and job.created_at < datetime.utcnow() - app.config['EXPORT_JOB_TIMEOUT']:
+        # Its worker was restarted or killed mid-render, or it is stuck; either way it will not finish now
+        job.status = 'failed'
+        job.error = 'The export did not finish in time. Please start it again.'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return jsonify(export_job_json(job))
+
+@app.route('/export_jobs/<int:job_id>/download')
+def download_export(job_id):
+    if not session.get('admin_authenticated'):
+        flash('Please login to generate PDF', 'error')
+        return redirect(url_for('admin_login'))
     
-    c.save()
-    pdf_buffer.seek(0)
+    job = ExportJob.query.get_or_404(job_id)
+    if job.status != 'done' or not os.path.exists(export_path(job.id)):
+        flash('That PDF export is not available', 'error')
+        return redirect(url_for('report'))
     
     return send_file(
-        pdf_buffer,
+        export_path(job.id),
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=f'ranger_signatures_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        download_name=f'ranger_signatures_{job.created_at.strftime("%Y%m%d_%H%M%S")}.pdf'
     )
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Benchmark the upload, report, signature and PDF paths against a synthetic database.
+
+    python benchmark_app.py                                   # SQLite, 100 and 1000 rangers
+    python benchmark_app.py --rangers 500,5000 --json > after.json
+    python benchmark_app.py --database postgresql://localhost/bench --compare before.json
+
+For each ranger count it seeds a fresh database (and blob store) with
+synthetic signatures, then measures, each in its own process:
+
+- ``upload``: ``process_signature_image`` throughput on a mixed corpus
+- ``report``: ``/report`` render time and query count, all and pending only, and its contact sheet
+- ``signature``: ``/signature/<id>`` latency, cold, cached and as a 304
+- ``pdf``: ``/print_pdf`` wall time and peak RSS, with a cold and a warm cache
+- ``condense``: ``chat-gpt5-condense.py`` wall time and peak RSS on the same images
+- ``startup``: time to import the app and serve a first request, and its RSS; with
+  gunicorn installed (Linux), also boot time and per-worker memory with and without preloading
+
+A Postgres database given with ``--database`` is emptied first. ``--compare``
+prints how each number changed against the JSON of an earlier run.
+"""
+
+import argparse
+import html
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmark_images import synthetic_corpus, synthetic_signature
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASES = ('startup', 'upload', 'report', 'signature', 'pdf', 'condense')
+# Share of seeded signatures in each status
+STATUS_MIX = (('approved', 0.7), ('pending', 0.2), ('rejected', 0.1))
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)  # bytes on macOS, KB elsewhere
+
+
+def timed(fn, repeat=1):
+    """Best wall time of fn() over repeat runs, in ms"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2)
+
+
+def load_app():
+    import app
+    return app
+
+
+def admin_client(app):
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['admin_authenticated'] = True
+    return client
+
+
+class QueryCounter:
+    """Counts SQL statements sent while active"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def seed(rangers, seed_value=0):
+    """Fill an empty database with rangers and synthetic, already-processed signatures"""
+    app = load_app()
+    rnd = random.Random(seed_value)
+    with app.app.app_context():
+        app.db.drop_all()
+        app.db.create_all()
+        for start in range(0, rangers, 200):
+            for i in range(start, min(start + 200, rangers)):
+                ranger = app.Ranger(ranger_id=f'R{i:06d}')
+                # Drawn on the dashboard canvas: the common case, and cheap to generate
+                image = synthetic_signature(seed_value * 1000003 + i, (800, 400), None, 'PNG')
+                status = rnd.choices([s for s, _ in STATUS_MIX], [w for _, w in STATUS_MIX])[0]
+                ranger.signature = app.Signature(status=status, **app.store_signature_image(image))
+                app.db.session.add(ranger)
+            app.db.session.commit()
+    return {'rangers': rangers}
+
+
+def bench_upload(args):
+    from imaging import DEFAULT_PIPELINE, process_signature_image
+    corpus = synthetic_corpus(args.images)
+    start = time.perf_counter()
+    for image_data in corpus:
+        process_signature_image(image_data, DEFAULT_PIPELINE)
+    elapsed = time.perf_counter() - start
+    return {'images': len(corpus), 'images_per_s': round(len(corpus) / elapsed, 2),
+            'mean_ms': round(elapsed / len(corpus) * 1000, 2)}
+
+
+def bench_report(args):
+    app = load_app()
+    client = admin_client(app)
+    results = {}
+    with app.app.app_context():
+        counter = QueryCounter(app.db.engine)
+    for name, url in (('all', '/report'), ('pending', '/report?status=pending')):
+        client.get(url)  # warm up templates and connections
+        before = counter.count
+        results[f'{name}_ms'] = timed(lambda: client.get(url), args.repeat)
+        results[f'{name}_queries'] = (counter.count - before) // args.repeat
+
+    # The page's contact sheet: composited on the first fetch, then served from the image cache
+    page = client.get('/report').get_data(as_text=True)
+    sheet_url = html.unescape(page.split('<image href="', 1)[1].split('"', 1)[0])
+    for run in ('cold', 'warm'):
+        start = time.perf_counter()
+        size = len(client.get(sheet_url).data)
+        results[f'sheet_{run}_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    results['sheet_kb'] = round(size / 1024, 1)
+    return results
+
+
+def bench_signature(args):
+    app = load_app()
+    client = app.app.test_client()
+    with app.app.app_context():
+        ids = [ranger_id for (ranger_id,) in app.db.session.query(app.Signature.ranger_id)]
+    sample = random.Random(0).sample(ids, min(args.requests, len(ids)))
+
+    latencies = {'cold': [], 'cached': [], 'not_modified': []}
+    for ranger_id in sample:
+        url = f'/signature/{ranger_id}'
+        for kind in ('cold', 'cached'):
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies[kind].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        latencies['not_modified'].append(time.perf_counter() - start)
+
+    results = {'requests': len(sample)}
+    for kind, values in latencies.items():
+        values.sort()
+        results[f'{kind}_mean_ms'] = round(statistics.mean(values) * 1000, 2)
+        results[f'{kind}_p95_ms'] = round(values[int(len(values) * 0.95)] * 1000, 2)
+    return results
+
+
+def bench_pdf(args):
+    app = load_app()
+    client = admin_client(app)
+    with app.app.app_context():
+        approved = app.Signature.query.filter_by(status='approved').count()
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in client.get('/print_pdf').response)
+    return {'signatures': approved, 'ms': round((time.perf_counter() - start) * 1000, 2),
+            'pdf_kb': round(size / 1024, 1)}
+
+
+def bench_condense(args):
+    app = load_app()
+    workdir = os.path.join(args.data_dir, 'condense')
+    shutil.rmtree(workdir, ignore_errors=True)
+    folder = os.path.join(workdir, 'signatures')
+    os.makedirs(folder)
+    with app.app.app_context():
+        rows = app.db.session.query(app.Ranger.ranger_id, app.Signature.image_hash).join(app.Ranger.signature)
+        for ranger_id, key in rows.filter(app.Signature.status == 'approved'):
+            with open(os.path.join(folder, f'{ranger_id}.png'), 'wb') as f:
+                f.write(app.blob_store().get(key))
+    count = len(os.listdir(folder))
+
+    # Measure the script alone, in a process that has not loaded the app
+    code = (f'import os, resource, runpy, sys, time; sys.path.insert(0, {HERE!r}); start = time.perf_counter(); '
+            f'runpy.run_path({os.path.join(HERE, "chat-gpt5-condense.py")!r}, run_name="__main__"); '
+            'print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)')
+    output = subprocess.run([sys.executable, '-c', code], cwd=workdir, check=True,
+                            capture_output=True, text=True).stdout.split()
+    rss = int(output[-1]) / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    return {'signatures': count, 'ms': round(float(output[-2]) * 1000, 2), 'child_peak_rss_mb': round(rss, 1)}
+
+
+# Run in a fresh interpreter: this script has already imported Pillow (through benchmark_images)
+STARTUP_CODE = '''
+import resource, sys, time
+sys.path.insert(0, {here!r})
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/login')
+print(imported - start, time.perf_counter() - imported, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      int('PIL' in sys.modules), int('reportlab' in sys.modules))
+'''
+
+
+def proc_memory_mb(pid):
+    """(PSS, private) of a process in MB, from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Pss'] / 1024, (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+
+
+def gunicorn_workers(preload, workers=2, timeout=60):
+    """Boot time and mean per-worker (PSS, private) memory of a gunicorn server, in ms and MB"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    # Without preloading, skip the master's migration too: it would import the app in the master anyway
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0', DB_MIGRATE_ON_START='1' if preload else '0',
+               GUNICORN_ACCESS_LOG='/dev/null',
+               METRICS_DIR=os.path.join(tempfile.gettempdir(), f'bench-metrics-{port}'))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                               '--bind', f'127.0.0.1:{port}', 'app:app'],
+                              cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=1).read()
+                break
+            except OSError:
+                if server.poll() is not None or time.perf_counter() - start > timeout:
+                    raise SystemExit('gunicorn did not start')
+                time.sleep(0.05)
+        boot = time.perf_counter() - start
+        # Every worker, not just the one that answered, has to be up before it is measured
+        while True:
+            with open(f'/proc/{server.pid}/task/{server.pid}/children') as f:
+                children = [int(pid) for pid in f.read().split()]
+            if len(children) >= workers or time.perf_counter() - start > timeout:
+                break
+            time.sleep(0.05)
+        time.sleep(1)
+        memory = [proc_memory_mb(pid) for pid in children]
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return (round(boot * 1000, 2), round(statistics.mean(pss for pss, _ in memory), 1),
+            round(statistics.mean(private for _, private in memory), 1))
+
+
+def bench_startup(args):
+    runs = []
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_CODE.format(here=HERE)], cwd=args.data_dir, check=True,
+                                capture_output=True, text=True).stdout.split()
+        runs.append(output[-5:])
+    import_s, request_s, rss, pil, reportlab = min(runs, key=lambda run: float(run[0]))
+    results = {'import_ms': round(float(import_s) * 1000, 2), 'first_request_ms': round(float(request_s) * 1000, 2),
+               'rss_mb': round(int(rss) / 1024 / (1024 if sys.platform == 'darwin' else 1), 1),
+               'pillow_loaded': int(pil), 'reportlab_loaded': int(reportlab)}
+
+    if importlib.util.find_spec('gunicorn') and os.path.exists('/proc/self/smaps_rollup'):
+        for preload in (False, True):
+            suffix = 'preload' if preload else 'no_preload'
+            boot, pss, private = gunicorn_workers(preload)
+            results.update({f'boot_ms_{suffix}': boot, f'worker_pss_mb_{suffix}': pss,
+                            f'worker_private_mb_{suffix}': private})
+    return results
+
+
+BENCHMARKS = {
+    'seed': lambda args: seed(args.rangers),
+    'upload': bench_upload,
+    'report': bench_report,
+    'signature': bench_signature,
+    'pdf': bench_pdf,
+    'condense': bench_condense,
+    'startup': bench_startup,
+}
+
+
+def run_phase(phase, args, rangers, data_dir, **env):
+    """Run one benchmark in a fresh process (app settings come from the environment at import)"""
+    child_env = dict(os.environ, **env)
+    child_env.update({
+        'DATABASE_URL': args.database or f'sqlite:///{os.path.join(data_dir, "bench.db")}',
+        'BLOB_STORE_URL': os.path.join(data_dir, 'blobs'),
+        'EXPORT_DIR': os.path.join(data_dir, 'exports'),
+        'PDF_CACHE_DIR': child_env.get('PDF_CACHE_DIR', os.path.join(data_dir, 'pdf_cache')),
+    })
+    child_env.pop('CACHE_URL', None)
+    command = [sys.executable, os.path.abspath(__file__), '--phase', phase, '--rangers', str(rangers),
+               '--data-dir', data_dir, '--repeat', str(args.repeat), '--requests', str(args.requests),
+               '--images', str(args.images)]
+    process = subprocess.run(command, cwd=HERE, env=child_env, capture_output=True, text=True)
+    if process.returncode:
+        raise SystemExit(f'The {phase} benchmark failed:\n{process.stderr}')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_suite(args):
+    results = []
+
+    def record(path, rangers, **metrics):
+        results.append({'path': path, 'rangers': rangers, **metrics})
+        if not args.json:
+            print(f'{path:<12} {rangers or "-":>7}  ' + '  '.join(f'{k}={v}' for k, v in metrics.items()), flush=True)
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as data_dir:
+        if 'startup' in args.phases:
+            record('startup', None, **run_phase('startup', args, 0, data_dir))
+        if 'upload' in args.phases:
+            record('upload', None, **run_phase('upload', args, 0, data_dir))
+
+        for rangers in args.rangers:
+            run_phase('seed', args, rangers, data_dir)
+            for phase in ('report', 'signature', 'condense'):
+                if phase in args.phases:
+                    record(phase, rangers, **run_phase(phase, args, rangers, data_dir))
+            if 'pdf' in args.phases:
+                cache_dir = os.path.join(data_dir, f'pdf_cache_{rangers}')
+                for run in ('cold', 'warm'):
+                    record(f'pdf_{run}', rangers, **run_phase('pdf', args, rangers, data_dir, PDF_CACHE_DIR=cache_dir))
+    return results
+
+
+def compare(results, baseline, out=sys.stdout):
+    """Print the relative change of every numeric metric present in both runs"""
+    before = {(r['path'], r['rangers']): r for r in baseline['results']}
+    print(f'\nChange against {baseline["environment"].get("timestamp", "baseline")}:', file=out)
+    for result in results:
+        old = before.get((result['path'], result['rangers']))
+        if not old:
+            continue
+        changes = []
+        for key, value in result.items():
+            if key in ('path', 'rangers') or not isinstance(old.get(key), (int, float)) or not old[key]:
+                continue
+            changes.append(f'{key} {(value - old[key]) / old[key] * 100:+.0f}%')
+        print(f'{result["path"]:<12} {result["rangers"] or "-":>7}  ' + '  '.join(changes), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rangers', default='100,1000', help='comma-separated ranger counts to seed')
+    parser.add_argument('--database', help='database URL, e.g. postgresql://localhost/bench (default: a temporary SQLite file)')
+    parser.add_argument('--phases', default=','.join(PHASES), help=f'comma-separated subset of {",".join(PHASES)}')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per report measurement; the fastest counts')
+    parser.add_argument('--requests', type=int, default=100, help='signatures fetched in the signature benchmark')
+    parser.add_argument('--images', type=int, default=12, help='synthetic images in the upload benchmark')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--compare', metavar='JSON', help='results of an earlier --json run to compare against')
+    parser.add_argument('--phase', choices=BENCHMARKS, help=argparse.SUPPRESS)  # run one benchmark in this process
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        args.rangers = int(args.rangers)
+        result = BENCHMARKS[args.phase](args)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    args.rangers = [int(n) for n in args.rangers.split(',')]
+    args.phases = args.phases.split(',')
+    results = run_suite(args)
+    report = {
+        'environment': {
+            'database': (args.database or 'sqlite').split(':', 1)[0],
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f), sys.stderr if args.json else sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
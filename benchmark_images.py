@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compare image pipeline settings (see imaging.py) on a corpus of signatures.
+
+    python benchmark_images.py                  # synthetic corpus
+    python benchmark_images.py uploads/ --json  # your own images, machine-readable
+
+For every encoder preset and quantize mode, plus the original pipeline
+(full decode, no trimming, LANCZOS, RGB, optimize=True) as a baseline, it
+reports the time to process each image and the size of the result.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+
+from imaging import ENCODER_PRESETS, QUANTIZE_MODES, Pipeline, prepare_upload
+
+
+def synthetic_signature(seed, size, background, fmt):
+    """A random ink scrawl on a page, roughly like a photographed, scanned or drawn signature"""
+    rnd = random.Random(seed)
+    img = Image.new('RGBA' if background is None else 'RGB', size, background or (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    w, h = size
+    for _ in range(3):
+        points = [(rnd.uniform(0.1, 0.9) * w, rnd.uniform(0.3, 0.7) * h) for _ in range(rnd.randint(8, 16))]
+        draw.line(points, fill=(20, 20, 60, 255), width=max(2, w // 250), joint='curve')
+    if fmt == 'JPEG':
+        # Uneven lighting and sensor noise, as in a phone photo of paper
+        noise = Image.effect_noise(size, 12).convert('RGB')
+        img = Image.blend(img, noise, 0.08)
+    output = io.BytesIO()
+    img.save(output, format=fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def synthetic_corpus(count):
+    kinds = [
+        ((4032, 3024), (235, 232, 225), 'JPEG'),  # 12 MP phone photo
+        ((800, 400), None, 'PNG'),                # drawn on the dashboard canvas
+        ((2480, 1240), (255, 255, 255), 'PNG'),   # scanned at 300 dpi
+    ]
+    return [synthetic_signature(i, *kinds[i % len(kinds)]) for i in range(count)]
+
+
+def load_corpus(paths):
+    corpus = []
+    for path in paths:
+        names = [os.path.join(path, n) for n in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        for name in names:
+            with open(name, 'rb') as f:
+                corpus.append(f.read())
+    return corpus
+
+
+def benchmark(name, pipeline, corpus, repeat):
+    times = []
+    sizes = []
+    for image_data in corpus:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            processed, thumb, *_ = prepare_upload(image_data, pipeline)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        sizes.append(len(processed))
+    return {
+        'name': name,
+        'preset': pipeline.preset,
+        'quantize': pipeline.quantize,
+        'mean_ms': round(statistics.mean(times) * 1000, 2),
+        'max_ms': round(max(times) * 1000, 2),
+        'mean_kb': round(statistics.mean(sizes) / 1024, 1),
+        'total_kb': round(sum(sizes) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='image files or directories (default: a synthetic corpus)')
+    parser.add_argument('--count', type=int, default=12, help='synthetic images to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per image; the fastest counts')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.paths) if args.paths else synthetic_corpus(args.count)
+    configs = [('original', Pipeline(preset='small', quantize='none', fast_decode=False,
+                                       large_resample=Image.Resampling.LANCZOS, trim=False))]
+    configs += [(f'{preset}/{mode}', Pipeline(preset=preset, quantize=mode))
+                for mode in QUANTIZE_MODES for preset in ENCODER_PRESETS]
+    results = [benchmark(name, pipeline, corpus, args.repeat) for name, pipeline in configs]
+
+    if args.json:
+        print(json.dumps({'images': len(corpus), 'input_kb': round(sum(map(len, corpus)) / 1024, 1),
+                          'results': results}, indent=2))
+        return
+    print(f'{len(corpus)} images, {sum(map(len, corpus)) / 1024:.0f} KB in')
+    print(f'{"pipeline":<18} {"mean ms":>9} {"max ms":>9} {"mean KB":>9} {"total KB":>9}')
+    for r in results:
+        print(f'{r["name"]:<18} {r["mean_ms"]:>9} {r["max_ms"]:>9} {r["mean_kb"]:>9} {r["total_kb"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
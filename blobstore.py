@@ -0,0 +1,140 @@
+"""
+Content-addressed storage for signature images.
+
+Blobs are keyed by the SHA-256 of their bytes, so storing the same image twice
+is free and a key always refers to exactly one immutable image. The database
+only keeps the key plus a little metadata about the image.
+
+Two backends are available, chosen by ``BLOB_STORE_URL``:
+
+- a directory on local disk (the default), e.g. ``/var/data/blobs``
+- an S3 bucket, e.g. ``s3://ranger-signatures/blobs``; set ``S3_ENDPOINT_URL``
+  to use an S3-compatible server such as MinIO (needs ``boto3`` installed)
+"""
+
+import hashlib
+import os
+import tempfile
+
+
+def blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class FilesystemBlobStore:
+    """Blobs stored as files under root, sharded by the first bytes of their key"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data):
+        """Store data and return its key; a no-op if the blob already exists"""
+        key = blob_key(data)
+        path = self.path(key)
+        if os.path.exists(path):
+            os.utime(path)  # reused blobs count as new, so gc-blobs leaves them alone while their row is written
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a partial blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return key
+
+    def get(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, before=None):
+        """Yield every key, or only those last written before the given Unix time"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                if before is not None:
+                    try:
+                        if os.path.getmtime(os.path.join(dirpath, name)) >= before:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                yield name
+
+
+class S3BlobStore:
+    """Blobs stored as objects in an S3 (or S3-compatible) bucket"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('The S3 blob store needs boto3: pip install boto3')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _name(self, key):
+        return self.prefix + key
+
+    def put(self, data):
+        key = blob_key(data)
+        name = self._name(key)
+        if self.exists(key):
+            # Copying onto itself refreshes LastModified, like the filesystem store's utime
+            self.client.copy_object(Bucket=self.bucket, Key=name, CopySource={'Bucket': self.bucket, 'Key': name},
+                                    MetadataDirective='REPLACE')
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=name, Body=data)
+        return key
+
+    def get(self, key):
+        return self.open(key).read()
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._name(key))['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+
+    def keys(self, before=None):
+        """Yield every key, or only those last written before the given Unix time"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                if before is None or obj['LastModified'].timestamp() < before:
+                    yield obj['Key'][len(self.prefix):]
+
+
+def open_blob_store(url, endpoint_url=None):
+    """Create the blob store described by a BLOB_STORE_URL"""
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3BlobStore(bucket, prefix, endpoint_url)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return FilesystemBlobStore(url)
@@ -0,0 +1,194 @@
+"""
+Byte-bounded caching for signature images.
+
+Each web worker keeps an ``LRUCache`` of recently used image bytes (raw
+uploads, thumbnails and print-ready PDF encodings). Optionally a shared
+backend sits behind it so workers can reuse each other's work:
+
+- ``CACHE_URL=redis://host:6379/0`` uses Redis (needs ``redis`` installed)
+- ``CACHE_URL=/some/directory`` uses files in a directory, shared by every
+  worker on the same machine; also handy as a stand-in for Redis locally
+
+All values are bytes, so every backend can store them.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU mapping of keys to bytes, bounded by the total size of the values"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DirectoryCache:
+    """Shared cache stored as files in a directory, visible to every process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, self._file(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+
+class RedisCache:
+    """Shared cache in Redis; entries expire after ttl seconds"""
+
+    def __init__(self, url, ttl=7 * 24 * 3600):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('A redis:// CACHE_URL needs the redis package: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value):
+        self.client.set(key, value, ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class Cache:
+    """A local LRU in front of an optional shared backend, counting hits and misses.
+
+    A shared backend that is unavailable only costs cache misses; it never
+    makes a request fail.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'shared_errors': 0}
+        self._lock = threading.Lock()  # += on a dict entry is not atomic across a gthread worker's threads
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _shared(self, method, *args):
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception:
+            self._count('shared_errors')
+            return None
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        if self.shared is not None:
+            value = self._shared('get', key)
+            if value is not None:
+                self._count('shared_hits')
+                self.local.set(key, value)
+                return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self._shared('set', key, value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+            if self.shared is not None:
+                self._shared('delete', key)
+
+    def get_or_set(self, key, loader):
+        """Return the cached value for key, calling loader() to fill it on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+        return dict(
+            counters,
+            hit_ratio=round((lookups - counters['misses']) / lookups, 3) if lookups else None,
+            entries=len(self.local),
+            bytes=self.local.size,
+            max_bytes=self.local.max_bytes,
+            evictions=self.local.evictions,
+            shared_backend=type(self.shared).__name__ if self.shared is not None else None,
+        )
+
+
+def open_cache(max_bytes, url=None):
+    """Create the cache described by CACHE_MAX_BYTES and an optional CACHE_URL"""
+    shared = None
+    if url and url.startswith(('redis://', 'rediss://')):
+        shared = RedisCache(url)
+    elif url:
+        shared = DirectoryCache(url[len('file://'):] if url.startswith('file://') else url)
+    return Cache(LRUCache(max_bytes), shared)
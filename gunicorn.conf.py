@@ -0,0 +1,91 @@
+"""
+Gunicorn settings for production, read from the environment.
+
+Gunicorn picks this file up automatically when started from this directory:
+
+    gunicorn app:app
+
+The app is preloaded in the master and the database schema is brought up to
+date there before any worker starts; see GUNICORN_PRELOAD and
+DB_MIGRATE_ON_START below.
+
+Workers are threaded (gthread) by default. Image views spend most of their time
+waiting on the blob store or the client, so threads let one worker serve many
+of them at once, while each thread only holds a database connection for the
+metadata query (see DB_POOL_SIZE in app.py). WEB_CONCURRENCY x GUNICORN_THREADS
+is the number of requests served at once; keep WEB_CONCURRENCY x (DB_POOL_SIZE +
+DB_MAX_OVERFLOW) below the database's connection limit.
+
+GUNICORN_WORKER_CLASS=gevent also works once gevent is installed
+(pip install gevent) and GUNICORN_PRELOAD=0, but the upload and PDF process
+pools are not tested under its monkey-patching.
+"""
+
+import gc
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))  # gevent only
+
+# PDF packets stream for a while; requests stuck longer than this get their worker restarted
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so a slow leak (e.g. Pillow buffers) cannot grow forever
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# Heartbeat files in memory rather than on a possibly slow container disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Import the app once in the master and fork workers from it, so every worker shares one copy of
+# Flask, SQLAlchemy, Pillow and ReportLab instead of importing its own. Thread and process pools
+# are only started on first use, i.e. in each worker after forking
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Bring the database schema up to date once per start, in the master, rather than in every worker.
+# Set to 0 when a pre-deploy step runs `flask --app app init-db` instead
+migrate_on_start = os.environ.get('DB_MIGRATE_ON_START', '1') == '1'
+
+# Workers share their metrics through this directory, so /metrics covers all of them
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'signature-metrics'))
+
+
+def on_starting(server):
+    if migrate_on_start:
+        from app import app, db, init_db
+        with app.app_context():
+            init_db()
+            db.engine.dispose()  # workers must not inherit the connection used for this
+
+    # Counters restart with the server; drop what workers of a previous run left behind
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+    if preload_app:
+        # Loaded lazily by the app; importing them here shares them between workers too
+        import imaging  # noqa: F401 (Pillow)
+        import quality  # noqa: F401 (NumPy)
+        from reportlab.pdfbase import pdfmetrics  # noqa: F401
+        # Keep the garbage collector from touching (and so copying) the master's objects in every worker
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if 'app' in sys.modules:
+        from app import app, db, metrics
+        with app.app_context():
+            db.engine.dispose(close=False)  # never share the master's pooled connections
+        metrics.reset()  # start from zero rather than from the master's numbers
@@ -0,0 +1,206 @@
+"""
+Signature image processing.
+
+Kept free of Flask and database imports so that worker processes can import
+it cheaply: uploads are processed in a process pool, away from web requests.
+
+Processing is tuned by a ``Pipeline``:
+
+- ``preset``: PNG encoder effort, one of ``ENCODER_PRESETS``
+- ``quantize``: ``auto`` stores black-ink signatures as grayscale and keeps
+  colour ink in RGB; ``none`` always keeps RGB; ``gray``, ``bilevel`` (1-bit
+  ink on white) and ``palette`` trade fidelity for much smaller files
+- ``trim``: crop to the bounding box of the ink plus a small margin, so the
+  signature fills the stored image (and its cell in the PDF packet)
+- ``large_downscale``/``large_resample``: the cheaper filter used once an
+  image shrinks by at least that factor, where LANCZOS buys nothing visible
+- ``fast_decode``: let JPEG decode at 1/2, 1/4 or 1/8 scale and reduce other
+  formats by box averaging before the final resample
+
+``benchmark_images.py`` compares the settings on a corpus of signatures.
+"""
+
+import io
+import math
+from collections import namedtuple
+
+from PIL import Image, ImageChops
+
+from packet import is_grayscale
+
+MAX_SIZE = (800, 400)
+# Report card thumbnails; cards show signatures at most ~300x150 CSS pixels, doubled for high-DPI screens
+THUMBNAIL_SIZE = (400, 200)
+# Report contact sheets: a THUMBNAIL_SIZE tile per signature, at most SHEET_TILES per sheet so
+# compositing one never needs more than a few megapixels of memory
+SHEET_COLUMNS = 6
+SHEET_TILES = 60
+
+ENCODER_PRESETS = {
+    'fast': {'compress_level': 1},
+    'balanced': {'compress_level': 6},
+    # Level 9 plus a search over PNG filters: the slowest and smallest
+    'small': {'optimize': True},
+}
+
+QUANTIZE_MODES = ('auto', 'none', 'gray', 'bilevel', 'palette')
+
+# Channel spread still counted as gray ink, allowing for colour noise in photos and scans
+GRAY_TOLERANCE = 24
+
+Pipeline = namedtuple(
+    'Pipeline',
+    'preset quantize max_size large_downscale large_resample fast_decode threshold palette_colors trim trim_margin',
+    defaults=('balanced', 'auto', MAX_SIZE, 3, Image.Resampling.BILINEAR, True, 160, 16, True, 0.03)
+)
+
+DEFAULT_PIPELINE = Pipeline()
+
+
+def ink_bbox(img, threshold=160):
+    """Bounding box of the ink: pixels darker than threshold (and not transparent), or None if blank"""
+    ink = img.convert('L').point(lambda v: 255 if v < threshold else 0)
+    if img.mode in ('RGBA', 'LA'):
+        ink = ImageChops.darker(ink, img.getchannel('A').point(lambda a: 255 if a >= 128 else 0))
+    return ink.getbbox()
+
+
+def trim_whitespace(img, threshold=160, margin=0.03):
+    """Crop to the ink, keeping a margin (a fraction of the ink's larger side); blank images are left alone"""
+    bbox = ink_bbox(img, threshold)
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    pad = max(2, round(margin * max(right - left, bottom - top)))
+    return img.crop((max(0, left - pad), max(0, top - pad), min(img.width, right + pad), min(img.height, bottom + pad)))
+
+
+def decode(image_data, pipeline=DEFAULT_PIPELINE):
+    """Decode an image, trim it and shrink it to fit pipeline.max_size, flattened onto white"""
+    img = Image.open(io.BytesIO(image_data))
+    max_w, max_h = pipeline.max_size
+    if pipeline.fast_decode and img.format == 'JPEG':
+        # Decode straight to at most twice the target size instead of every pixel
+        img.draft('L' if pipeline.quantize in ('gray', 'bilevel') else 'RGB', (max_w * 2, max_h * 2))
+    if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    if pipeline.trim:
+        img = trim_whitespace(img, pipeline.threshold, pipeline.trim_margin)
+
+    factor = max(img.width / max_w, img.height / max_h)
+    if factor > 1:
+        resample = pipeline.large_resample if factor >= pipeline.large_downscale else Image.Resampling.LANCZOS
+        img.thumbnail(pipeline.max_size, resample, reducing_gap=2.0 if pipeline.fast_decode else None)
+
+    # Flatten after resizing: fewer pixels to composite, and Pillow resizes alpha premultiplied
+    if img.mode in ('RGBA', 'LA'):
+        bg = Image.new(img.mode[:-1], img.size, 'white')
+        bg.paste(img, mask=img.getchannel('A'))
+        img = bg
+    if img.mode == 'L' and pipeline.quantize == 'none':
+        img = img.convert('RGB')
+    return img
+
+
+def quantize(img, pipeline=DEFAULT_PIPELINE):
+    """Reduce colours as pipeline.quantize asks"""
+    if pipeline.quantize == 'none':
+        return img
+    if pipeline.quantize == 'auto':
+        return img.convert('L') if img.mode == 'RGB' and is_grayscale(img, GRAY_TOLERANCE) else img
+    if pipeline.quantize == 'gray':
+        return img.convert('L')
+    if pipeline.quantize == 'bilevel':
+        threshold = pipeline.threshold
+        return img.convert('L').point(lambda v: 255 if v >= threshold else 0, mode='1')
+    if pipeline.quantize == 'palette':
+        return img.convert('RGB').quantize(colors=pipeline.palette_colors)
+    raise ValueError(f'Unknown quantize mode {pipeline.quantize!r}; expected one of {QUANTIZE_MODES}')
+
+
+def encode(img, preset='balanced'):
+    output = io.BytesIO()
+    img.save(output, format='PNG', **ENCODER_PRESETS[preset])
+    return output.getvalue()
+
+
+def process_signature_image(image_data, pipeline=DEFAULT_PIPELINE):
+    """Flatten, downscale and re-encode an uploaded image as PNG"""
+    return encode(quantize(decode(image_data, pipeline), pipeline), pipeline.preset)
+
+
+def thumbnail(img, preset='balanced'):
+    """Small PNG of a decoded signature for report cards"""
+    img = img.copy()
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')  # resizing 1-bit or palette images would fall back to nearest neighbour
+    img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    if img.mode == 'RGB' and is_grayscale(img):
+        img = img.convert('L')
+    return encode(img, preset)
+
+
+def make_thumbnail(image_data, preset='balanced'):
+    """Small PNG of a signature for report cards"""
+    return thumbnail(Image.open(io.BytesIO(image_data)), preset)
+
+
+def thumbnail_size(width, height):
+    """Size of the thumbnail of a width x height image, or of a whole tile if that is unknown"""
+    if not width or not height:
+        return THUMBNAIL_SIZE
+    # The same arithmetic as Image.thumbnail, which rounds the free side to whichever of floor and ceil
+    # keeps the aspect ratio closest, not to the nearest pixel
+    x, y = THUMBNAIL_SIZE
+    if x >= width and y >= height:
+        return width, height
+    aspect = width / height
+    if x / y >= aspect:
+        x = max(min(math.floor(y * aspect), math.ceil(y * aspect), key=lambda n: abs(aspect - n / y)), 1)
+    else:
+        y = max(min(math.floor(x / aspect), math.ceil(x / aspect), key=lambda n: 0 if n == 0 else abs(aspect - x / n)), 1)
+    return x, y
+
+
+def sheet_tiles(sizes, columns=SHEET_COLUMNS):
+    """Lay out thumbnails of the given sizes on a contact sheet.
+
+    Returns ((x, y, w, h) per thumbnail, sheet width, sheet height). Tile i is
+    always in the same grid cell, centred in it, so the layout of a sheet never
+    depends on anything but the sizes.
+    """
+    tile_w, tile_h = THUMBNAIL_SIZE
+    tiles = []
+    for i, (w, h) in enumerate(sizes):
+        row, col = divmod(i, columns)
+        tiles.append((col * tile_w + (tile_w - w) // 2, row * tile_h + (tile_h - h) // 2, w, h))
+    rows = -(-len(sizes) // columns)
+    return tiles, min(len(sizes), columns) * tile_w, rows * tile_h
+
+
+def contact_sheet(thumbs, image_format='PNG', preset='balanced', columns=SHEET_COLUMNS):
+    """Composite thumbnail PNGs (None leaves a tile blank) into one PNG or WEBP, as laid out by sheet_tiles"""
+    images = [Image.open(io.BytesIO(thumb)) if thumb else None for thumb in thumbs]
+    for img in images:
+        if img is not None:
+            img.load()
+    mode = 'L' if all(img is None or img.mode == 'L' for img in images) else 'RGB'
+    tiles, width, height = sheet_tiles([img.size if img else THUMBNAIL_SIZE for img in images], columns)
+    sheet = Image.new(mode, (width, height), 'white')
+    for img, (x, y, _, _) in zip(images, tiles):
+        if img is not None:
+            sheet.paste(img.convert(mode), (x, y))
+    if image_format == 'WEBP':
+        # About half the size of the PNG, but the encoder needs ~90 MB for a full sheet
+        output = io.BytesIO()
+        sheet.save(output, format='WEBP', lossless=True, method=2)  # higher methods are slower for ~no gain here
+        return output.getvalue()
+    return encode(sheet, preset)
+
+
+def prepare_upload(image_data, pipeline=DEFAULT_PIPELINE):
+    """Process an upload in one go: returns (processed PNG, thumbnail PNG, width, height, quality metrics)"""
+    from quality import score_images
+    img = decode(image_data, pipeline)
+    processed = encode(quantize(img, pipeline), pipeline.preset)
+    return processed, thumbnail(img, pipeline.preset), img.width, img.height, score_images([img])[0]
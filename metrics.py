@@ -0,0 +1,217 @@
+"""
+Counters and histograms exposed in the Prometheus text format.
+
+Kept free of Flask imports, like imaging.py, so pool workers can use
+``timed_call``. Each web worker records into its own ``Registry``; with
+``METRICS_DIR`` set, workers also write their numbers to files in that
+directory, and ``/metrics`` adds up every worker's file, so a scrape that
+lands on any gunicorn worker sees the whole server.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; Prometheus' default buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """A monotonically increasing number per combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self, values):
+        for label_values, value in sorted(values.items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [count per bucket..., count, sum]
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            state = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += 1
+        state[-1] += value
+
+    def samples(self, values):
+        for label_values, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield self.name + '_bucket', format_labels(self.labels, label_values, [('le', format_value(bound))]), count
+            yield self.name + '_bucket', format_labels(self.labels, label_values, [('le', '+Inf')]), state[-2]
+            yield self.name + '_count', format_labels(self.labels, label_values), state[-2]
+            yield self.name + '_sum', format_labels(self.labels, label_values), state[-1]
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+
+class Registry:
+    """This process's metrics, optionally shared with other workers through a directory"""
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.metrics = {}
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._last_flush = 0
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self.metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def inc(self, name, *label_values, amount=1):
+        with self._lock:
+            self.metrics[name].inc(*label_values, amount=amount)
+        self._maybe_flush()
+
+    def observe(self, name, value, *label_values):
+        with self._lock:
+            self.metrics[name].observe(value, *label_values)
+        self._maybe_flush()
+
+    @contextmanager
+    def span(self, name, *label_values):
+        """Time the body of a with block into the histogram called name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, *label_values)
+
+    def reset(self):
+        """Forget every value, e.g. in a forked worker that inherited its parent's"""
+        with self._lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+        self._last_flush = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                           for labels, value in metric.values.items()]
+                    for name, metric in self.metrics.items()}
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this worker's numbers to the shared directory, if there is one"""
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, os.path.join(self.directory, f'{os.getpid()}.json'))
+        except OSError:
+            pass  # metrics must never break a request
+
+    def _collect(self):
+        """Every worker's values, summed; just this process's without a shared directory"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, rows in snapshot.items():
+                merged.setdefault(metric_name, []).extend(rows)
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        collected = self._collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            values = {}
+            for labels, value in collected.get(name, ()):
+                key = tuple(labels)
+                values[key] = metric.merge(values[key], value) if key in values else value
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(f'{sample}{labels} {format_value(value)}' for sample, labels, value in metric.samples(values))
+        return '\n'.join(lines) + '\n'
+
+
+def timed_call(fn, *args):
+    """Call fn(*args) and return (result, seconds taken); for timing work done in pool workers"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class Timed:
+    """Proxy that times calls to some of an object's methods, as spans named prefix + method"""
+
+    def __init__(self, target, registry, histogram, prefix, methods):
+        self._target = target
+        self._registry = registry
+        self._histogram = histogram
+        self._prefix = prefix
+        self._methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._methods:
+            return attr
+
+        def timed(*args, **kwargs):
+            with self._registry.span(self._histogram, self._prefix + name):
+                return attr(*args, **kwargs)
+        return timed
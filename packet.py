@@ -0,0 +1,534 @@
+"""
+PDF packet generation for approved signatures.
+
+ReportLab's canvas keeps every page (and every inline image) in memory until
+``save()`` is called, so a packet of a few thousand signatures has to be built
+completely before the first byte can be sent. This module writes the PDF
+incrementally instead: each page is laid out, encoded and yielded as soon as
+its signatures have been drawn, and only the small cross-reference table is
+kept around until the end.
+
+Signature images are embedded as pre-encoded XObjects (``PdfImage``). Each one
+is downscaled to the cell size once, compressed with PNG predictors and kept
+in an ``ImageCache``, so regenerating a packet only splices cached streams
+together instead of decoding and re-encoding every signature.
+
+Whole pages can be cached the same way: ``build_page`` lays a page out as a
+``PageFragment`` that does not depend on its position in the document, and
+``render_pages`` writes fragments from any source, e.g. a ``PageCache``, so
+only pages whose signatures changed need to be laid out again.
+"""
+
+import io
+import os
+import struct
+import tempfile
+import zlib
+from collections import deque, namedtuple
+from functools import partial
+from itertools import islice
+
+# Pillow and ReportLab are imported by the functions that need them, so the web
+# app can import this module (for Layout, the caches and the writer) without
+# paying for them until a worker actually prepares an image or lays out a page
+
+INCH = 72.0
+
+# Same layout as the original condense script: landscape Letter, 2.4" x 1.2" cells
+PAGE_SIZE = (11 * INCH, 8.5 * INCH)
+MARGIN = 0.5 * INCH
+GUTTER = 0.20 * INCH
+TARGET_CELL_W = 2.4 * INCH
+TARGET_CELL_H = 1.2 * INCH
+IMAGE_DPI = 200  # resolution signatures are stored at for printing
+
+# Fixed object numbers; everything else is allocated as pages are written
+CATALOG_OBJ = 1
+PAGES_OBJ = 2
+FONT_OBJ = 3
+OBLIQUE_FONT_OBJ = 4
+INFO_OBJ = 5
+
+# One cell of the packet: a prepared image (or None if it could not be loaded),
+# an optional caption and the text to print in place of an unreadable image
+Cell = namedtuple('Cell', 'image caption error', defaults=(None, '[Error loading signature]'))
+
+
+def compute_grid(page_w, page_h, margin, gutter, target_w, target_h):
+    """Work out how many cells fit on a page and their evenly spread size"""
+    avail_w = page_w - 2 * margin
+    avail_h = page_h - 2 * margin
+    cols = max(1, int((avail_w + gutter) // (target_w + gutter)))
+    rows = max(1, int((avail_h + gutter) // (target_h + gutter)))
+    cell_w = (avail_w - (cols - 1) * gutter) / cols
+    cell_h = (avail_h - (rows - 1) * gutter) / rows
+    return cols, rows, cell_w, cell_h
+
+
+def fit_within(img_w, img_h, box_w, box_h, caption_h=0):
+    """Scale an image to fit a box while keeping its aspect ratio"""
+    if caption_h:
+        box_h = max(1, box_h - caption_h)
+    scale = min(box_w / img_w, box_h / img_h)
+    return img_w * scale, img_h * scale
+
+
+class Layout:
+    """Page geometry for a packet, all sizes in points"""
+
+    def __init__(self, page_size=PAGE_SIZE, margin=MARGIN, gutter=GUTTER,
+                 target_w=TARGET_CELL_W, target_h=TARGET_CELL_H,
+                 caption_h=0, caption_pt=9, draw_cell_box=False, dpi=IMAGE_DPI):
+        self.page_w, self.page_h = page_size
+        self.margin = margin
+        self.gutter = gutter
+        self.caption_h = caption_h
+        self.caption_pt = caption_pt
+        self.draw_cell_box = draw_cell_box
+        self.dpi = dpi
+        self.cols, self.rows, self.cell_w, self.cell_h = compute_grid(
+            self.page_w, self.page_h, margin, gutter, target_w, target_h)
+        self.cells_per_page = self.cols * self.rows
+
+    def cell_origin(self, idx):
+        """Bottom-left corner of the idx-th cell on a page, filled row by row from the top"""
+        r = idx // self.cols
+        q = idx % self.cols
+        x = self.margin + q * (self.cell_w + self.gutter)
+        y_top = self.page_h - self.margin - r * (self.cell_h + self.gutter)
+        return x, y_top - self.cell_h
+
+    def pixel_box(self):
+        """Largest image, in pixels, that is worth embedding in a cell"""
+        return (max(1, round(self.cell_w / INCH * self.dpi)),
+                max(1, round((self.cell_h - self.caption_h) / INCH * self.dpi)))
+
+    @property
+    def key(self):
+        """Identifies the image size this layout needs, for keying cached images"""
+        return '%dx%d' % self.pixel_box()
+
+
+def pdf_string(text):
+    """Escape text for use as a PDF literal string"""
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return ('(' + escaped + ')').encode('cp1252', 'replace')
+
+
+def pdf_number(value):
+    return ('%.2f' % value).rstrip('0').rstrip('.').encode('ascii')
+
+
+class PdfImage:
+    """An image stream ready to be written as a PDF XObject as-is"""
+
+    def __init__(self, width, height, colorspace, data, decode_parms=b''):
+        self.width = width
+        self.height = height
+        self.colorspace = colorspace
+        self.data = data
+        self.decode_parms = decode_parms
+
+    def to_bytes(self):
+        header = b'%d %d %s %d\n' % (self.width, self.height, self.colorspace.encode('ascii'), len(self.decode_parms))
+        return header + self.decode_parms + self.data
+
+    @classmethod
+    def from_bytes(cls, raw):
+        header, rest = raw.split(b'\n', 1)
+        width, height, colorspace, parms_len = header.split()
+        parms_len = int(parms_len)
+        return cls(int(width), int(height), colorspace.decode('ascii'), rest[parms_len:], rest[:parms_len])
+
+
+def png_idat(png_bytes):
+    """Return the concatenated IDAT payload of a PNG file"""
+    pos = 8
+    chunks = []
+    while pos < len(png_bytes):
+        length, chunk_type = struct.unpack('>I4s', png_bytes[pos:pos + 8])
+        if chunk_type == b'IDAT':
+            chunks.append(png_bytes[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    return b''.join(chunks)
+
+
+def is_grayscale(img, tolerance=0):
+    """True if no pixel of an RGB image has channels differing by more than tolerance"""
+    from PIL import ImageChops
+    r, g, b = img.split()
+    if tolerance == 0:
+        return ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(r, b).getbbox() is None
+    return (ImageChops.difference(r, g).getextrema()[1] <= tolerance
+            and ImageChops.difference(r, b).getextrema()[1] <= tolerance)
+
+
+def prepare_image(img, box):
+    """Downscale a PIL image to fit box (w, h pixels) and encode it as a PdfImage.
+
+    This runs once per signature version, so it is allowed to be thorough:
+    black-ink signatures are stored as grayscale, and the pixels are encoded
+    both as plain Flate and with PNG predictors, keeping whichever is smaller.
+    """
+    from PIL import Image
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if img.width > box[0] or img.height > box[1]:
+        img = img.copy()
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+    if img.mode == 'RGB' and is_grayscale(img):
+        img = img.convert('L')
+
+    colors = 1 if img.mode == 'L' else 3
+    colorspace = 'DeviceGray' if img.mode == 'L' else 'DeviceRGB'
+    flate = zlib.compress(img.tobytes(), 9)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    predicted = png_idat(buffer.getvalue())
+    if len(predicted) < len(flate):
+        parms = b'<< /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >>' % (colors, img.width)
+        return PdfImage(img.width, img.height, colorspace, predicted, parms)
+    return PdfImage(img.width, img.height, colorspace, flate)
+
+
+def prepare_image_bytes(image_data, box):
+    """Like prepare_image, for stored signature bytes"""
+    from PIL import Image
+    return prepare_image(Image.open(io.BytesIO(image_data)), box)
+
+
+def prepare_image_file(path, box):
+    """Like prepare_image, for an image file: turned upright, flattened onto white and trimmed to the ink"""
+    from PIL import Image, ImageOps
+    from imaging import trim_whitespace
+    img = ImageOps.exif_transpose(Image.open(path))
+    if img.mode in ('RGBA', 'LA'):
+        paper = Image.new('RGB', img.size, 'white')
+        paper.paste(img, mask=img.split()[-1])
+        img = paper
+    else:
+        img = img.convert('RGB')
+    return prepare_image(trim_whitespace(img), box)
+
+
+def prepare_chunk(items, box, prepare=prepare_image_bytes):
+    """Prepare a page worth of (key, source) pairs with prepare(source, box); runs inside pool workers"""
+    prepared = []
+    for key, source in items:
+        try:
+            prepared.append((key, prepare(source, box)))
+        except Exception:
+            prepared.append((key, None))
+    return prepared
+
+
+def ordered_map(pool, fn, items, window):
+    """Like pool.map, but keeps at most window tasks in flight.
+
+    Results come back in input order, so pages rendered in parallel are still
+    written in a deterministic sequence, and a slow consumer never has more
+    than a window of finished pages waiting in memory.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def prepare_images(items, box, chunk_size, pool=None, window=8, prepare=prepare_image_bytes):
+    """Yield (key, PdfImage or None) for (key, image bytes) pairs, in order.
+
+    With a process pool, chunks of chunk_size images (one page each) are
+    decoded, resized and compressed on all cores at once, window chunks at a time.
+    Pass prepare=prepare_image_file for (key, file path) pairs instead.
+    """
+    chunks = iter_chunks(items, chunk_size)
+    if pool is None:
+        results = (prepare_chunk(chunk, box, prepare) for chunk in chunks)
+    else:
+        results = ordered_map(pool, partial(prepare_chunk, box=box, prepare=prepare), chunks, window)
+    for prepared in results:
+        yield from prepared
+
+
+class PageFragment:
+    """A laid-out page that can be written into any packet.
+
+    The content stream (already Flate-compressed) refers to its images by name
+    only; object numbers are assigned when ``PacketWriter.page`` writes it.
+    ``complete`` is False if any cell had no image, so it shows an error text
+    that should not be cached.
+    """
+
+    def __init__(self, images, content, complete=True):
+        self.images = images  # [(name, PdfImage)]
+        self.content = content
+        self.complete = complete
+
+    def to_bytes(self):
+        names = ' '.join(name for name, _ in self.images).encode('ascii')
+        parts = [self.content, names] + [image.to_bytes() for _, image in self.images]
+        return b'%d\n' % len(parts) + b''.join(b'%d\n' % len(part) + part for part in parts)
+
+    @classmethod
+    def from_bytes(cls, raw):
+        pos = raw.index(b'\n')
+        count = int(raw[:pos])
+        pos += 1
+        parts = []
+        for _ in range(count):
+            end = raw.index(b'\n', pos)
+            length = int(raw[pos:end])
+            parts.append(raw[end + 1:end + 1 + length])
+            pos = end + 1 + length
+        content, names, images = parts[0], parts[1].decode('ascii').split(), parts[2:]
+        return cls(list(zip(names, map(PdfImage.from_bytes, images))), content)
+
+
+def write_atomic(path, data):
+    """Write then rename, so concurrent workers never read a half-written file"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ImageCache:
+    """Directory of prepared PdfImages, keeping only the latest version of each key"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _dir(self, key):
+        return os.path.join(self.path, str(key))
+
+    def has(self, key, version):
+        return os.path.exists(os.path.join(self._dir(key), '%s.xobj' % version))
+
+    def get(self, key, version):
+        try:
+            with open(os.path.join(self._dir(key), '%s.xobj' % version), 'rb') as f:
+                return PdfImage.from_bytes(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, version, image):
+        path = self._dir(key)
+        os.makedirs(path, exist_ok=True)
+        filename = '%s.xobj' % version
+        write_atomic(os.path.join(path, filename), image.to_bytes())
+
+        # Older versions of this key can never be asked for again
+        for name in os.listdir(path):
+            if name != filename and name.endswith('.xobj'):
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
+
+
+class PageCache:
+    """Directory of PageFragments, keyed by a hash of what is on the page"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, '%s.page' % key)
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return PageFragment.from_bytes(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, fragment):
+        os.makedirs(self.path, exist_ok=True)
+        write_atomic(self._file(key), fragment.to_bytes())
+
+    def prune(self, keep):
+        """Delete every cached page whose key is not in keep"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.page') and name[:-len('.page')] not in keep:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+class PacketWriter:
+    """Minimal streaming PDF writer.
+
+    Every method returns the bytes to append to the output; the writer only
+    remembers object offsets and page references, never page content.
+    """
+
+    def __init__(self, page_size=PAGE_SIZE, title='Ranger Signatures'):
+        self.page_w, self.page_h = page_size
+        self.title = title
+        self.offset = 0
+        self.offsets = {}
+        self.page_refs = []
+        self.next_obj = INFO_OBJ + 1
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, num, body, stream=None):
+        self.offsets[num] = self.offset
+        data = b'%d 0 obj\n' % num + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return self._emit(data + b'\nendobj\n')
+
+    def _allocate(self):
+        num = self.next_obj
+        self.next_obj += 1
+        return num
+
+    def header(self):
+        """Start the document: header, catalog, shared font and info dict"""
+        out = self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        out += self._object(CATALOG_OBJ, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES_OBJ)
+        for num, font in ((FONT_OBJ, b'Helvetica'), (OBLIQUE_FONT_OBJ, b'Helvetica-Oblique')):
+            out += self._object(num, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % font)
+        out += self._object(INFO_OBJ, b'<< /Title ' + pdf_string(self.title) + b' /Producer (Ranger Signature Manager) >>')
+        return out
+
+    def image(self, image):
+        """Write a PdfImage as an XObject and return (object number, bytes)"""
+        num = self._allocate()
+        body = (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /%s '
+                b'/BitsPerComponent 8 /Filter /FlateDecode' % (image.width, image.height, image.colorspace.encode('ascii')))
+        if image.decode_parms:
+            body += b' /DecodeParms ' + image.decode_parms
+        body += b' /Length %d >>' % len(image.data)
+        return num, self._object(num, body, image.data)
+
+    def page(self, fragment):
+        """Write a PageFragment: its images, content stream and page object"""
+        out = b''
+        xobjects = {}
+        for name, image in fragment.images:
+            xobjects[name], data = self.image(image)
+            out += data
+        content_obj = self._allocate()
+        page_obj = self._allocate()
+        stream = fragment.content
+        out += self._object(content_obj, b'<< /Filter /FlateDecode /Length %d >>' % len(stream), stream)
+        xobject_dict = b' '.join(b'/%s %d 0 R' % (name.encode('ascii'), num) for name, num in xobjects.items())
+        out += self._object(page_obj, (
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] '
+            b'/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> /XObject << %s >> >> /Contents %d 0 R >>'
+            % (PAGES_OBJ, pdf_number(self.page_w), pdf_number(self.page_h), FONT_OBJ, OBLIQUE_FONT_OBJ,
+               xobject_dict, content_obj)
+        ))
+        self.page_refs.append(page_obj)
+        return out
+
+    def trailer(self):
+        """Finish the document: page tree, cross-reference table and trailer"""
+        kids = b' '.join(b'%d 0 R' % num for num in self.page_refs)
+        out = self._object(PAGES_OBJ, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_refs)))
+        xref_offset = self.offset
+        size = self.next_obj
+        lines = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for num in range(1, size):
+            lines.append(b'%010d 00000 n \n' % self.offsets[num])
+        out += b''.join(lines)
+        out += b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            size, CATALOG_OBJ, INFO_OBJ, xref_offset)
+        return self._emit(out)
+
+
+def iter_chunks(items, size):
+    """Group an iterator into lists of up to size items without materialising it"""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def text_op(x, y, text, size, font='F1'):
+    return b'BT /%s %s Tf %s %s Td %s Tj ET' % (
+        font.encode('ascii'), pdf_number(size), pdf_number(x), pdf_number(y), pdf_string(text))
+
+
+def build_page(cells, layout):
+    """Lay out up to one page of cells as a PageFragment"""
+    ops = []
+    images = []
+    complete = True
+
+    for idx, cell in enumerate(cells):
+        x, y = layout.cell_origin(idx)
+        caption_h = layout.caption_h if cell.caption else 0
+
+        # Optional cell box
+        if layout.draw_cell_box:
+            ops.append(b'q 0.25 w [3 2] 0 d %s %s %s %s re S Q' % (
+                pdf_number(x), pdf_number(y), pdf_number(layout.cell_w), pdf_number(layout.cell_h)))
+
+        if cell.image is not None:
+            name = 'Im%d' % idx
+            images.append((name, cell.image))
+
+            # Fit and center within cell, above the caption if there is one
+            fit_w, fit_h = fit_within(cell.image.width, cell.image.height, layout.cell_w, layout.cell_h, caption_h)
+            img_x = x + (layout.cell_w - fit_w) / 2
+            img_y = y + (layout.cell_h - caption_h - fit_h) / 2 + caption_h
+            ops.append(b'q %s 0 0 %s %s %s cm /%s Do Q' % (
+                pdf_number(fit_w), pdf_number(fit_h), pdf_number(img_x), pdf_number(img_y), name.encode('ascii')))
+        else:
+            # Fallback text
+            ops.append(text_op(x + 4, y + layout.cell_h / 2, cell.error, 8, font='F2'))
+            complete = False
+
+        if cell.caption:
+            from reportlab.pdfbase.pdfmetrics import stringWidth
+            text_w = stringWidth(cell.caption, 'Helvetica', layout.caption_pt)
+            ops.append(text_op(x + (layout.cell_w - text_w) / 2, y + 2, cell.caption, layout.caption_pt))
+
+    return PageFragment(images, zlib.compress(b'\n'.join(ops)), complete)
+
+
+def render_pages(pages, layout=None, title='Ranger Signatures', progress=None):
+    """Yield a PDF packet made of PageFragments, page by page.
+
+    ``pages`` is consumed lazily. ``progress`` is called with the number of
+    pages written so far after each page.
+    """
+    layout = layout or Layout()
+    writer = PacketWriter((layout.page_w, layout.page_h), title)
+    yield writer.header()
+
+    for fragment in pages:
+        yield writer.page(fragment)
+        if progress:
+            progress(len(writer.page_refs))
+
+    yield writer.trailer()
+
+
+def render_packet(cells, layout=None, title='Ranger Signatures', progress=None):
+    """Yield a PDF packet page by page.
+
+    ``cells`` is any iterable of ``Cell``; it is consumed lazily, one page
+    worth of cells at a time. ``progress`` is called with the number of pages
+    written so far after each page.
+    """
+    layout = layout or Layout()
+    pages = (build_page(chunk, layout) for chunk in iter_chunks(cells, layout.cells_per_page))
+    return render_pages(pages, layout, title, progress)
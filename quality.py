@@ -0,0 +1,137 @@
+"""
+Quality metrics for signature images, so moderators can triage the pending queue.
+
+Each decoded image is reduced to a fixed-size grayscale grid, and a whole
+batch of grids is scored at once with NumPy:
+
+- ``ink_coverage``: share of pixels darker than the ink threshold
+- ``ink_width`` / ``ink_height``: size of the ink's bounding box, in pixels of the image
+- ``contrast``: how much darker the ink is than the paper, 0-1
+- ``background_level`` / ``background_noise``: mean and spread of the paper's
+  brightness; gray or unevenly lit photos have a low level or a high spread
+- ``ink_hash``: 64-bit difference hash of the image, equal for (near) duplicates
+
+From those, ``quality_score`` (0-1, the worst of the individual checks) and
+``quality_issue`` (the first failed check, or None for a clean signature) are
+derived. Duplicates need the other signatures, so app.py flags those.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+# Grid every image is scored on: a report thumbnail's size, so strokes a pixel or two wide survive
+GRID_SIZE = (400, 200)
+INK_THRESHOLD = 160  # same as imaging.Pipeline.threshold
+
+# Below BLANK_COVERAGE an image is blank; below MIN_INK_COVERAGE nearly empty. Above
+# MAX_INK_COVERAGE the "ink" is mostly a dark or gray background rather than a signature
+BLANK_COVERAGE = 0.001
+MIN_INK_COVERAGE = 0.01
+MAX_INK_COVERAGE = 0.45
+MIN_INK_SIZE = (150, 40)  # px; smaller signatures print as a smudge
+MIN_CONTRAST = 0.5
+MIN_BACKGROUND_LEVEL = 200  # mean paper brightness, 0-255
+MAX_BACKGROUND_NOISE = 20  # standard deviation of paper brightness
+
+QUALITY_ISSUES = ('blank', 'near_empty', 'tiny', 'low_contrast', 'background', 'duplicate')
+
+
+def grayscale(img):
+    """An image as 8-bit gray, with any transparency flattened onto white paper"""
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        paper = Image.new('RGBA', img.size, 'white')
+        paper.alpha_composite(img)
+        img = paper
+    return img.convert('L')
+
+
+def score_images(images, threshold=INK_THRESHOLD):
+    """Quality metrics (Signature column values) for a batch of decoded PIL images, one dict per image"""
+    if not images:
+        return []
+    gray = [grayscale(img) for img in images]
+    grids = np.stack([np.asarray(img.resize(GRID_SIZE, Image.Resampling.BOX)) for img in gray])
+    small = np.stack([np.asarray(img.resize((9, 8), Image.Resampling.BOX)) for img in gray])
+    sizes = np.array([img.size for img in images], dtype=np.float64)
+    n, grid_h, grid_w = grids.shape
+
+    ink = grids < threshold
+    ink_pixels = ink.sum(axis=(1, 2))
+    paper_pixels = grid_h * grid_w - ink_pixels
+    coverage = ink_pixels / (grid_h * grid_w)
+
+    # Bounding box: first and last grid row/column with any ink, scaled back to each image's size
+    cols = ink.any(axis=1)
+    rows = ink.any(axis=2)
+    has_ink = cols.any(axis=1)
+    ink_w = np.where(has_ink, grid_w - cols[:, ::-1].argmax(axis=1) - cols.argmax(axis=1), 0) * sizes[:, 0] / grid_w
+    ink_h = np.where(has_ink, grid_h - rows[:, ::-1].argmax(axis=1) - rows.argmax(axis=1), 0) * sizes[:, 1] / grid_h
+
+    values = grids.astype(np.float64)
+    ink_level = (values * ink).sum(axis=(1, 2)) / np.maximum(ink_pixels, 1)
+    paper = ~ink
+    paper_level = (values * paper).sum(axis=(1, 2)) / np.maximum(paper_pixels, 1)
+    paper_var = (np.square(values - paper_level[:, None, None]) * paper).sum(axis=(1, 2)) / np.maximum(paper_pixels, 1)
+    paper_noise = np.sqrt(paper_var)
+    contrast = np.where(has_ink & (paper_pixels > 0), (paper_level - ink_level) / 255, 0)
+
+    # Each check scores 1 when it passes, falling towards 0 the further it misses
+    coverage_score = (np.clip(coverage / MIN_INK_COVERAGE, 0, 1)
+                      * np.clip((1 - coverage) / (1 - MAX_INK_COVERAGE), 0, 1))
+    size_score = np.clip(np.minimum(ink_w / MIN_INK_SIZE[0], ink_h / MIN_INK_SIZE[1]), 0, 1)
+    contrast_score = np.clip(contrast / MIN_CONTRAST, 0, 1)
+    background_score = np.minimum(np.clip(paper_level / MIN_BACKGROUND_LEVEL, 0, 1),
+                                  np.clip(MAX_BACKGROUND_NOISE / np.maximum(paper_noise, 1e-9), 0, 1))
+    background_score = np.where(coverage > MAX_INK_COVERAGE, np.minimum(background_score, coverage_score),
+                                background_score)
+    score = np.minimum.reduce([coverage_score, size_score, contrast_score, background_score])
+
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    hashes = np.packbits(bits.reshape(n, 64), axis=1)
+
+    results = []
+    for i in range(n):
+        if coverage[i] < BLANK_COVERAGE:
+            issue = 'blank'
+        elif coverage[i] < MIN_INK_COVERAGE:
+            issue = 'near_empty'
+        elif coverage[i] > MAX_INK_COVERAGE:
+            issue = 'background'  # dark or gray paper, read as ink
+        elif size_score[i] < 1:
+            issue = 'tiny'
+        elif contrast_score[i] < 1:
+            issue = 'low_contrast'
+        elif background_score[i] < 1:
+            issue = 'background'
+        else:
+            issue = None
+        results.append({
+            'ink_coverage': round(float(coverage[i]), 5),
+            'ink_width': int(round(ink_w[i])),
+            'ink_height': int(round(ink_h[i])),
+            'contrast': round(float(contrast[i]), 4),
+            'background_level': round(float(paper_level[i]), 2),
+            'background_noise': round(float(paper_noise[i]), 2),
+            # A blank image "duplicates" every other blank one; it is flagged as blank instead
+            'ink_hash': hashes[i].tobytes().hex() if issue != 'blank' else None,
+            'quality_score': round(float(score[i]), 4),
+            'quality_issue': issue,
+        })
+    return results
+
+
+def score_image_bytes(images):
+    """score_images for stored (already processed) image bytes; unreadable images score None"""
+    decoded = []
+    for image_data in images:
+        try:
+            img = Image.open(io.BytesIO(image_data))
+            img.load()
+            decoded.append(img)
+        except Exception:
+            decoded.append(None)
+    scores = iter(score_images([img for img in decoded if img is not None]))
+    return [next(scores) if img is not None else None for img in decoded]
@@ -31,6 +31,13 @@ def test_imports():
         print(f"✗ Pillow not found: {e}")
         return False
     
+    try:
+        import numpy
+        print(f"✓ NumPy {numpy.__version__}")
+    except ImportError as e:
+        print(f"✗ NumPy not found: {e}")
+        return False
+    
     try:
         import reportlab
         print(f"✓ ReportLab")